@@ -0,0 +1,148 @@
+"""Benchmarks repltable against a local stand-in database.
+
+python bench_suite.py --latency 0.005 --output results.json
+python bench_suite.py --compare old.json results.json
+"""
+
+import asyncio
+import json
+from argparse import ArgumentParser
+from platform import python_version
+from time import perf_counter
+from typing import Callable, Dict, List
+
+from repltable import Database, __version__  # type: ignore
+from repltable import asynchronous  # type: ignore
+from repltable.testing import StandInServer  # type: ignore
+
+
+def timed(fn: Callable[[], object], repeat: int = 1) -> float:
+    """Run fn `repeat` times and return the mean seconds per run."""
+    start = perf_counter()
+    for _ in range(repeat):
+        fn()
+    return (perf_counter() - start) / repeat
+
+
+def bench_gets(server: StandInServer, keys: int) -> Dict[str, float]:
+    server.update({f"get:{i}": f"value {i}" for i in range(keys)})
+    db = Database(server.url)
+    cold = timed(lambda: [db.get(f"get:{i}") for i in range(keys)]) / keys
+    warm = timed(lambda: [db.get(f"get:{i}") for i in range(keys)]) / keys
+    batched = timed(
+        lambda: Database(server.url).get_many(f"get:{i}" for i in range(keys))
+    )
+    db.close()
+    return {"get_cold": cold, "get_warm": warm, f"get_many_{keys}": batched}
+
+
+def bench_set_bulk(server: StandInServer, sizes: List[int]) -> Dict[str, float]:
+    db = Database(server.url)
+    results = {
+        f"set_bulk_{size}": timed(
+            lambda: db.set_bulk({f"bulk:{i}": f"value {i}" for i in range(size)}), 3
+        )
+        for size in sizes
+    }
+    db.close()
+    return results
+
+
+def bench_table(server: StandInServer, rows: int) -> Dict[str, float]:
+    results: Dict[str, float] = {}
+    for layout, page_size in (("single", None), ("paged", 1000)):
+        db = Database(server.url)
+        name = f"bench_{layout}_{rows}"
+        table = db.get_table(name, page_size=page_size)
+        with table.batch():
+            for i in range(rows):
+                table.insert({"id": i, "name": f"user {i}", "score": i % 100})
+        results[f"table_insert_{layout}_{rows}"] = timed(
+            lambda: table.insert({"id": rows, "name": "new", "score": 0}), 5
+        )
+        db.drop_table(name)
+        db.close()
+    results[f"table_get_one_scan_{rows}"] = timed(lambda: table.get_one(id=rows - 1), 5)
+    table.create_index("id")
+    results[f"table_get_one_indexed_{rows}"] = timed(
+        lambda: table.get_one(id=rows - 1), 5
+    )
+    return results
+
+
+def bench_concurrency(server: StandInServer, keys: int) -> Dict[str, float]:
+    server.update({f"conc:{i}": f"value {i}" for i in range(keys)})
+
+    def sync_serial() -> None:
+        db = Database(server.url)
+        for i in range(keys):
+            db.get(f"conc:{i}")
+        db.close()
+
+    def sync_pooled() -> None:
+        db = Database(server.url)
+        db.populate_cache("conc:")
+        db.close()
+
+    async def async_gathered() -> None:
+        db = asynchronous.Database(server.url)
+        await db.populate_cache("conc:")
+        await db.close()
+
+    return {
+        f"populate_serial_{keys}": timed(sync_serial),
+        f"populate_sync_{keys}": timed(sync_pooled),
+        f"populate_async_{keys}": timed(lambda: asyncio.run(async_gathered())),
+    }
+
+
+def run(latency: float, bandwidth: int, rows: List[int]) -> Dict[str, object]:
+    results: Dict[str, float] = {}
+    with StandInServer(latency=latency, bandwidth=bandwidth or None) as server:
+        results.update(bench_gets(server, 100))
+        results.update(bench_set_bulk(server, [1, 10, 100, 1000]))
+        for count in rows:
+            results.update(bench_table(server, count))
+        results.update(bench_concurrency(server, 200))
+    return {
+        "version": __version__,
+        "python": python_version(),
+        "latency": latency,
+        "bandwidth": bandwidth,
+        "results": results,
+    }
+
+
+def compare(old: Dict[str, object], new: Dict[str, object]) -> None:
+    before: Dict[str, float] = old["results"]  # type: ignore
+    after: Dict[str, float] = new["results"]  # type: ignore
+    print(f"{'benchmark':<36}{old['version']:>12}{new['version']:>12}{'ratio':>8}")
+    for name in sorted(before.keys() & after.keys()):
+        ratio = after[name] / before[name] if before[name] else float("inf")
+        print(f"{name:<36}{before[name]:>12.6f}{after[name]:>12.6f}{ratio:>8.2f}")
+
+
+if __name__ == "__main__":
+    parser = ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument(
+        "--latency", type=float, default=0.0, help="seconds added to each request"
+    )
+    parser.add_argument(
+        "--bandwidth", type=int, default=0, help="bytes per second, 0 for unlimited"
+    )
+    parser.add_argument("--rows", type=int, nargs="+", default=[1000, 10000, 100000])
+    parser.add_argument("--output", help="write the results to this json file")
+    parser.add_argument(
+        "--compare", nargs=2, metavar=("OLD", "NEW"), help="compare two result files"
+    )
+    args = parser.parse_args()
+
+    if args.compare:
+        with open(args.compare[0]) as old, open(args.compare[1]) as new:
+            compare(json.load(old), json.load(new))
+    else:
+        report = run(args.latency, args.bandwidth, args.rows)
+        if args.output:
+            with open(args.output, "w") as f:
+                json.dump(report, f, indent=2)
+        print(json.dumps(report, indent=2))
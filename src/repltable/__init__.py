@@ -1,4 +1,31 @@
 __version__ = "3.0.0"
+from .buffer import WriteBuffer
+from .cache import DiskCache, LRUCache, RawCache
+from .codec import Codec
+from .coherence import Coherence
+from .columnar import ColumnarRows
 from .database import Database, Table
+from .keyindex import KeyIndex
+from .metrics import Metrics
+from .prefetch import Prefetcher
+from .query import Query
+from .retry import RetryPolicy
+from .stream import LazyRows
 
-__all__ = ["Database", "Table"]
+__all__ = [
+    "Database",
+    "Table",
+    "LRUCache",
+    "DiskCache",
+    "RawCache",
+    "WriteBuffer",
+    "Metrics",
+    "KeyIndex",
+    "Codec",
+    "Query",
+    "ColumnarRows",
+    "RetryPolicy",
+    "Coherence",
+    "Prefetcher",
+    "LazyRows",
+]
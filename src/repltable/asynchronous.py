@@ -1,10 +1,43 @@
 from __future__ import annotations
-from httpx import AsyncClient
-from json import JSONDecodeError
-from typing import Any, Dict, List, Optional, Union
+import asyncio
+from httpx import AsyncBaseTransport, AsyncClient, AsyncHTTPTransport, Limits, Timeout
+from typing import (
+    Any,
+    AsyncGenerator,
+    AsyncIterator,
+    Awaitable,
+    Callable,
+    Dict,
+    Iterable,
+    Iterator,
+    List,
+    Optional,
+    Set,
+    Tuple,
+    Union,
+)
 from os import environ
+from collections import deque
 from collections.abc import MutableMapping
-from .util import filter_list
+from itertools import islice
+from contextlib import asynccontextmanager
+from .buffer import DELETED, WriteBuffer
+from .cache import RawCache
+from .catalog import CATALOG, catalog_key, discover, entry, sample_fields
+from .codec import Codec
+from .coherence import PREFIX, Coherence, journal_key
+from .columnar import ColumnarRows, plain
+from .flight import AsyncSingleFlight, Read, ReadGuard
+from .index import HashIndex, Index, SortedIndex, find, select
+from .keyindex import KeyIndex
+from .metrics import Metrics
+from .transport import DEFAULT_LIMITS, DEFAULT_TIMEOUT, shared_async_transport
+from .retry import AsyncRetryTransport, RetryPolicy
+from .prefetch import Prefetcher
+from .stream import RowStream, valid_rows
+from .query import Predicate, Query, project
+from .pages import dump_pages, is_manifest, manifest, page_count, page_key
+from .util import INTERNAL, MISSING
 
 
 class Database:
@@ -12,31 +45,138 @@ class Database:
 
     Args:
         db_url (Optional[str], optional): Your database URL. Defaults to None. If not supplied, it will attempt to get it from the environment variables.
-        cache (MutableMapping, optional): The cache object to use. Should be dict-like (implement __setitem__ and __getitem__). Defaults to {}.
+        cache (MutableMapping, optional): The cache object to use. Should be dict-like (implement __setitem__ and __getitem__). Pass an LRUCache to bound its size. Defaults to {}.
+        write_behind (Optional[WriteBuffer], optional): Buffer writes and flush them in batches from a background task instead of sending each one immediately. Defaults to None.
+        metrics (Optional[Metrics], optional): Record latency, status codes, bytes, cache hits and table writes, and pass them on to its exporters. Defaults to None.
+        key_index (Optional[KeyIndex], optional): Answer keys(), prefix() and table existence checks from a local index instead of listing the database each time. Defaults to None.
+        codec (Optional[Codec], optional): How values are encoded for storage, including optional compression. Defaults to plain JSON.
+        transport (Optional[AsyncBaseTransport], optional): The httpx transport to send requests through, for sharing a connection pool you manage yourself. Defaults to None.
+        limits (Optional[Limits], optional): The connection pool limits, including keep-alive, when creating a transport. Defaults to DEFAULT_LIMITS.
+        timeout (Union[float, Timeout, None], optional): The request timeout. Defaults to DEFAULT_TIMEOUT.
+        http2 (bool, optional): Multiplex requests over HTTP/2 when creating a transport. Needs `httpx[http2]`. Defaults to False.
+        shared (bool, optional): Reuse the process-wide transport for this db_url, so every Database sharing it reuses warm connections. Defaults to False.
+        retry (Optional[RetryPolicy], optional): Retry failed requests with backoff, and optionally hedge slow GETs. Defaults to None (no retries).
+        coherence (Optional[Coherence], optional): Journal this database's writes, and drop the keys other processes change from the cache. Defaults to None (the cache only sees this database's own writes).
+        prefetcher (Optional[Prefetcher], optional): Read the keys related to a cache miss in the background. Defaults to None.
 
     Raises:
         ValueError: If no db_url is passed and REPLIT_DB_URL is not found in the environment variables.
     """
 
-    __slots__ = ("http", "db_url", "_cache")
+    __slots__ = (
+        "http",
+        "db_url",
+        "_cache",
+        "_buffer",
+        "_metrics",
+        "_keys",
+        "_codec",
+        "_owns_transport",
+        "_coherence",
+        "_flights",
+        "_reads",
+        "_prefetcher",
+    )
 
     def __init__(
         self,
         db_url: Optional[str] = None,
         cache: Optional[MutableMapping] = None,
+        write_behind: Optional[WriteBuffer] = None,
+        metrics: Optional[Metrics] = None,
+        key_index: Optional[KeyIndex] = None,
+        codec: Optional[Codec] = None,
+        transport: Optional[AsyncBaseTransport] = None,
+        limits: Optional[Limits] = None,
+        timeout: Union[float, Timeout, None] = DEFAULT_TIMEOUT,
+        http2: bool = False,
+        shared: bool = False,
+        retry: Optional[RetryPolicy] = None,
+        coherence: Optional[Coherence] = None,
+        prefetcher: Optional[Prefetcher] = None,
     ):
         self.db_url = db_url or environ.get("REPLIT_DB_URL")
         if not self.db_url:
             raise ValueError(
                 "No db_url passed, and REPLIT_DB_URL wasn't found in env vars!"
             )
-        self.http = AsyncClient(base_url=self.db_url)
-        self._cache: MutableMapping[str, Any] = cache or {}
+        self._owns_transport = transport is None and not shared
+        if transport is None:
+            transport = (
+                shared_async_transport(self.db_url, limits, http2)
+                if shared
+                else AsyncHTTPTransport(limits=limits or DEFAULT_LIMITS, http2=http2)
+            )
+        if retry is not None:
+            transport = AsyncRetryTransport(transport, retry)
+        self.http = AsyncClient(
+            base_url=self.db_url,
+            transport=transport,
+            timeout=timeout,
+            event_hooks=(
+                {"request": [metrics.aon_request], "response": [metrics.aon_response]}
+                if metrics is not None
+                else None
+            ),
+        )
+        self._metrics = metrics
+        self._keys = key_index
+        self._codec = codec or Codec()
+        self._cache: MutableMapping[str, Any] = cache if cache is not None else {}
+        if isinstance(cache, RawCache) and cache.codec is None:
+            cache.codec = self._codec
+        self._buffer = write_behind
+        self._coherence = coherence
+        # concurrent misses on the same key share one request
+        self._prefetcher = prefetcher
+        self._flights = AsyncSingleFlight()
+        self._reads = ReadGuard()
+
+    async def populate_cache(
+        self,
+        prefix: str = "",
+        concurrency: int = 16,
+        progress: Optional[Callable[[int, int], Any]] = None,
+    ) -> None:
+        """Entirely populate the cache with all the keys in the database.
+        With a RawCache, the values aren't decoded until they are first read.
+
+        Args:
+            prefix (str, optional): Only warm the keys that start with this prefix. Defaults to "".
+            concurrency (int, optional): How many keys to fetch at once. Defaults to 16.
+            progress (Optional[Callable[[int, int], Any]], optional): Called with (done, total) after each key is fetched. Defaults to None.
+        """
+        keys = await self.prefix(prefix)
+        semaphore = asyncio.Semaphore(max(concurrency, 1))
+        done = 0
 
-    async def populate_cache(self):
-        """Entirely populate the cache with all the keys in the database."""
-        for key in await self.keys():
-            self._cache[key] = await self.get(key)
+        async def fetch(key: str) -> None:
+            nonlocal done
+            async with semaphore:
+                await self.__warm(key)
+            done += 1
+            if progress:
+                progress(done, len(keys))
+
+        await asyncio.gather(*(fetch(key) for key in keys))
+
+    async def validate_cache(self, prefix: str = "") -> int:
+        """Check the cache against one listing of the database, dropping keys that no longer exist.
+        Useful after starting from a persisted cache, like a DiskCache.
+
+        Args:
+            prefix (str, optional): Only check the keys that start with this prefix. Defaults to "".
+
+        Returns:
+            int: how many keys were dropped.
+        """
+        remote = {key async for key in self.__stream_keys(prefix)}
+        stale = [
+            key for key in self._cache if key.startswith(prefix) and key not in remote
+        ]
+        for key in stale:
+            self._cache.pop(key, None)
+        return len(stale)
 
     async def keys(self) -> List[str]:
         """List all the keys in the database.
@@ -48,6 +188,7 @@ class Database:
 
     async def prefix(self, prefix: str) -> List[str]:
         """List all the keys in the database that start with a certain prefix.
+        The keys repltable keeps its own bookkeeping in are left out.
 
         Args:
             prefix (str): the prefix to search for.
@@ -55,8 +196,78 @@ class Database:
         Returns:
             List[str]: Every key in the database that starts with the prefix.
         """
+        return [
+            key for key in await self.__listing(prefix) if not key.startswith(INTERNAL)
+        ]
+
+    async def __listing(self, prefix: str) -> List[str]:
+        if self._keys is not None:
+            if self._keys.stale:
+                await self.refresh_keys()
+            return self._keys.prefix(prefix)
+        return await self._flights.do(("prefix", prefix), lambda: self.__list(prefix))
+
+    async def __list(self, prefix: str) -> List[str]:
         return (await self.http.get(f"?prefix={prefix}")).text.splitlines()
 
+    async def refresh_keys(self) -> None:
+        """Reload the key index from a full listing of the database. Does nothing if it is off."""
+        if self._keys is not None:
+            await self._flights.do(("keys",), self.__reload_keys)
+
+    async def __reload_keys(self) -> None:
+        self._keys.load([key async for key in self.__stream_keys("")])  # type: ignore
+
+    async def iter_keys(self, prefix: str = "") -> AsyncGenerator[str, None]:
+        """Iterate over the keys in the database that start with a prefix, as the listing streams in.
+
+        Args:
+            prefix (str, optional): the prefix to search for. Defaults to "".
+
+        Yields:
+            str: Every key in the database that starts with the prefix.
+        """
+        if self._keys is not None:
+            for key in await self.prefix(prefix):
+                yield key
+            return
+        async for key in self.__stream_keys(prefix):
+            if not key.startswith(INTERNAL):
+                yield key
+
+    async def __stream_keys(self, prefix: str) -> AsyncGenerator[str, None]:
+        async with self.http.stream("GET", f"?prefix={prefix}") as res:
+            async for line in res.aiter_lines():
+                if line:
+                    yield line
+
+    async def iter_items(
+        self, prefix: str = "", concurrency: int = 16
+    ) -> AsyncGenerator[Tuple[str, Any], None]:
+        """Iterate over the keys that start with a prefix along with their values.
+        Values are fetched lazily, with at most `concurrency` requests in flight.
+
+        Args:
+            prefix (str, optional): the prefix to search for. Defaults to "".
+            concurrency (int, optional): How many values to fetch ahead. Defaults to 16.
+
+        Yields:
+            Tuple[str, Any]: Every key that starts with the prefix, and its value.
+        """
+        window: deque = deque()
+        try:
+            async for key in self.iter_keys(prefix):
+                window.append((key, asyncio.ensure_future(self.get(key))))
+                if len(window) >= concurrency:
+                    key, task = window.popleft()
+                    yield key, await task
+            while window:
+                key, task = window.popleft()
+                yield key, await task
+        finally:
+            for _, task in window:
+                task.cancel()
+
     async def get(
         self, key: str
     ) -> Union[Dict[str, Any], str, List[Dict[str, Any]], None]:
@@ -68,16 +279,220 @@ class Database:
         Returns:
             Union[Dict[str, Any], str, List[Dict[str, Any]], None]: Either a dictionary, string, list of dictionaries, or None.
         """
-        if key in self._cache:
-            return self._cache[key]
-        res = await self.http.get(f"/{key}")
-        if res.status_code == 404:
-            return None
+        cached = self.__cached(key)
+        if cached is not MISSING:
+            # a columnar Table's rows are kept compact, but read back as a list
+            return plain(cached)
+        if self._prefetcher is not None and self._prefetcher.claim(key):
+            self.__read_ahead(key)
+        return await self._fetch(key)
+
+    def __cached(self, key: str) -> Any:
+        # the pending or cached value of a key, or MISSING
+        if self._buffer is not None:
+            pending = self._buffer.get(key, MISSING)
+            if pending is not MISSING:
+                return None if pending is DELETED else pending
+        if self._coherence is not None and self._coherence.worker is None:
+            # the task can only be created once there is a running event loop
+            self._coherence.worker = asyncio.create_task(self.__poll_loop())
+        cached = self._cache.get(key, MISSING)
+        if self._metrics is not None:
+            self._metrics.cache(key, cached is not MISSING)
+        return cached
+
+    def __read_ahead(self, key: str) -> None:
+        self.__spawn(self.__prefetch_related(key))
+
+    def __spawn(self, work: Awaitable[None]) -> None:
+        prefetcher: Prefetcher = self._prefetcher  # type: ignore
+        if prefetcher.worker is None:
+            prefetcher.worker = set()
+        # keep a reference, so the task isn't garbage collected while it runs
+        task = asyncio.ensure_future(work)
+        prefetcher.worker.add(task)
+        task.add_done_callback(prefetcher.worker.discard)
+
+    async def __prefetch_related(self, key: str) -> None:
+        prefetcher: Prefetcher = self._prefetcher  # type: ignore
         try:
-            r = res.json()
-        except JSONDecodeError:
-            r = res.text
-        return r
+            if prefetcher.related is not None:
+                related: Iterable[str] = prefetcher.related(key)
+            else:
+                related = await self.prefix(prefetcher.group(key))  # type: ignore
+            wanted = list(islice(self.__unread(related, key), prefetcher.max_keys))
+        except Exception:
+            wanted = []
+        finally:
+            prefetcher.release()
+        for sibling in wanted[: prefetcher.reserve(len(wanted))]:
+            self.__spawn(self.__prefetch(sibling))
+
+    async def __prefetch(self, key: str) -> None:
+        prefetcher: Prefetcher = self._prefetcher  # type: ignore
+        try:
+            await self._fetch(key, decode=False)
+        except Exception:
+            # prefetching is only a hint, so failures are left for the real read
+            prefetcher.release()
+        else:
+            prefetcher.release(prefetched=1)
+
+    def __unread(self, keys: Iterable[str], missed: str) -> Iterator[str]:
+        # cached keys and keys with buffered writes are skipped. A key written while it is being
+        # prefetched isn't cached either, since the response may be older than the write
+        for key in keys:
+            if key == missed or key in self._cache:
+                continue
+            if self._buffer is None or self._buffer.get(key, MISSING) is MISSING:
+                yield key
+
+    async def _fetch(self, key: str, decode: bool = True) -> Any:
+        if not decode and isinstance(self._cache, RawCache):
+            # the response is cached as it is, and only decoded once it is read
+            return await self._flights.do(
+                ("raw", key, self._reads.generation(key)), lambda: self.__fetch_raw(key)
+            )
+        # a read that begins after a local write doesn't share one that began before it
+        return await self._flights.do(
+            ("get", key, self._reads.generation(key)), lambda: self.__fetch(key)
+        )
+
+    async def __fetch_raw(self, key: str) -> None:
+        with self._reads.read(key) as read:
+            res = await self.http.get(f"/{key}")
+            if res.status_code == 404:
+                return
+            res.raise_for_status()
+            self.__remember(read, raw=res.content)
+
+    async def __warm(self, key: str) -> None:
+        if self.__cached(key) is MISSING:
+            await self._fetch(key, decode=False)
+
+    async def __fetch(self, key: str) -> Any:
+        with self._reads.read(key) as read:
+            res = await self.http.get(f"/{key}")
+            if res.status_code == 404:
+                return None
+            res.raise_for_status()
+            r = self._codec.decode(res.content)
+            self.__remember(read, r, res.content)
+            return r
+
+    def __remember(
+        self, read: Read, value: Any = MISSING, raw: Optional[bytes] = None
+    ) -> None:
+        # cached as the read ends, unless a local write overtook it or is still pending
+        if (
+            self._buffer is not None
+            and self._buffer.get(read.key, MISSING) is not MISSING
+        ):
+            return
+        key, cache = read.key, self._cache
+        if raw is not None and isinstance(cache, RawCache):
+            read.store = lambda: cache.store(key, raw, value)
+        else:
+            read.store = lambda: cache.__setitem__(key, value)
+
+    async def __stream_batches(
+        self, key: str, result: List[Any]
+    ) -> AsyncGenerator[List[Dict[str, Any]], None]:
+        # yields a table's rows a chunk at a time as they are decoded, so the event loop isn't
+        # blocked, then puts the value in result if it isn't a list of rows
+        stream = RowStream(self._codec)
+        async with self.http.stream("GET", f"/{key}") as res:
+            if res.status_code == 404:
+                result.append(None)
+                return
+            res.raise_for_status()
+            async for chunk in res.aiter_bytes():
+                rows = stream.feed(chunk)
+                if rows:
+                    yield rows
+        rows, value = stream.close()
+        if rows:
+            yield rows
+        result.append(value)
+
+    async def __fetch_table(self, key: str) -> Any:
+        return await self._flights.do(
+            ("get", key, self._reads.generation(key)), lambda: self.__stream_value(key)
+        )
+
+    async def __stream_value(self, key: str) -> Any:
+        rows: List[Dict[str, Any]] = []
+        result: List[Any] = []
+        with self._reads.read(key) as read:
+            async for batch in self.__stream_batches(key, result):
+                rows.extend(batch)
+            value = rows if result[0] is MISSING else result[0]
+            if value is not None:
+                self.__remember(read, value)
+            return value
+
+    async def iter_rows(self, table: str) -> AsyncGenerator[Dict[str, Any], None]:
+        """Iterate over a table's rows as they are downloaded and decoded, without keeping them.
+        Paged tables are read a page at a time.
+
+        Args:
+            table (str): the table to read.
+
+        Raises:
+            ValueError: if the table is not a valid table.
+
+        Yields:
+            Dict[str, Any]: every row in the table.
+        """
+        value = self.__cached(table)
+        if value is MISSING:
+            result: List[Any] = []
+            async for batch in self.__stream_batches(table, result):
+                for row in batch:
+                    yield row
+            value = result[0]
+        if is_manifest(value):
+            for page in range(value["pages"]):
+                for row in valid_rows(
+                    await self.get(page_key(table, page)) or [], table
+                ):
+                    yield row
+        elif isinstance(value, (list, ColumnarRows)):
+            for row in valid_rows(value, table):
+                yield row
+        elif value is not MISSING and value is not None:
+            raise ValueError(f"`{table}` is not a valid table.")
+
+    async def get_many(
+        self, keys: Iterable[str], concurrency: int = 16
+    ) -> Dict[str, Any]:
+        """Get multiple values from the database at once.
+        Cached keys are served locally, and the rest are fetched concurrently.
+
+        Args:
+            keys (Iterable[str]): the keys to request from the database.
+            concurrency (int, optional): How many keys to fetch at once. Defaults to 16.
+
+        Returns:
+            Dict[str, Any]: the value of every key, or None for keys that don't exist.
+        """
+        result: Dict[str, Any] = dict.fromkeys(keys)
+        misses: List[str] = []
+        for key in result:
+            # buffered writes are seen first, like in get
+            cached = self.__cached(key)
+            if cached is MISSING:
+                misses.append(key)
+            else:
+                result[key] = plain(cached)
+        semaphore = asyncio.Semaphore(max(concurrency, 1))
+
+        async def fetch(key: str) -> Any:
+            async with semaphore:
+                return await self._fetch(key)
+
+        result.update(zip(misses, await asyncio.gather(*map(fetch, misses))))
+        return result
 
     async def set(self, key: str, value: Any):
         """Set a value in the database.
@@ -94,12 +509,45 @@ class Database:
         Args:
             data (Dict[str, Any]): the data to set in the database.
         """
-        await self.http.post(
-            "/",
-            json=str(data),
-            headers={"Content-Type": "application/json"},
-        )
-        self._cache.update(data)
+        if self._buffer is not None:
+            if self._keys is not None:
+                self._keys.add(data)
+            self.__start_flusher()
+            full = self._buffer.add(data)
+            self._reads.wrote(data)
+            self._cache.update(data)
+            if full:
+                await self.flush()
+            return
+        encoded = await self._post(data)
+        if self._keys is not None:
+            self._keys.add(data)
+        if isinstance(self._cache, RawCache):
+            # stored with the bytes just sent, so the cache never has to encode the values itself
+            for key, value in data.items():
+                self._cache.store(key, encoded[key], value)
+        else:
+            self._cache.update(data)
+
+    def __keep_encoded(self, data: Dict[str, Any], encoded: Dict[str, str]) -> None:
+        # flushed values that are still decoded in a RawCache keep the bytes just sent too,
+        # unless they were set again since
+        if isinstance(self._cache, RawCache):
+            for key, value in data.items():
+                self._cache.keep_raw(key, encoded[key], value)
+
+    async def _post(
+        self, data: Dict[str, Any], deleted: Iterable[str] = ()
+    ) -> Dict[str, str]:
+        if self._coherence is not None:
+            # journalled after the values, so other processes never see the change first
+            data = {**data, **self._coherence.record(data, deleted)}
+        encoded = {key: self._codec.encode(value) for key, value in data.items()}
+        try:
+            await self.http.post("/", data=encoded)
+        finally:
+            self._reads.wrote(data)
+        return encoded
 
     async def delete(self, key: str):
         """Delete a key from the database.
@@ -107,15 +555,195 @@ class Database:
         Args:
             key (str): the key to delete from the database.
         """
-        await self.http.delete(f"/{key}")
-        if key in self._cache:
-            del self._cache[key]
+        if self._buffer is not None:
+            if self._keys is not None:
+                self._keys.discard(key)
+            self.__start_flusher()
+            full = self._buffer.discard(key)
+            self._reads.wrote([key])
+            self._cache.pop(key, None)
+            if full:
+                await self.flush()
+            return
+        try:
+            await self.http.delete(f"/{key}")
+        finally:
+            self._reads.wrote([key])
+        if self._coherence is not None:
+            await self._post({}, deleted=[key])
+        if self._keys is not None:
+            self._keys.discard(key)
+        self._cache.pop(key, None)
+
+    async def delete_many(
+        self, keys: Iterable[str], concurrency: int = 16
+    ) -> Dict[str, Exception]:
+        """Delete multiple keys from the database at once, concurrently.
+        Buffered writes are flushed first, so none of them can bring a deleted key back.
+
+        Args:
+            keys (Iterable[str]): the keys to delete from the database.
+            concurrency (int, optional): How many keys to delete at once. Defaults to 16.
 
-    async def get_table(self, table: str) -> Table:
+        Returns:
+            Dict[str, Exception]: the error for every key that couldn't be deleted. Empty if they all were.
+        """
+        keys = list(dict.fromkeys(keys))
+        if self._buffer is not None:
+            await self.flush()
+        failed = await self.__delete_keys(keys, concurrency)
+        deleted = [key for key in keys if key not in failed]
+        if deleted and self._coherence is not None:
+            await self._post({}, deleted=deleted)
+        if self._keys is not None:
+            self._keys.discard_many(deleted)
+        # keys that failed may or may not be gone, so they are dropped from the cache too
+        for key in keys:
+            self._cache.pop(key, None)
+        return failed
+
+    async def delete_prefix(
+        self, prefix: str, concurrency: int = 16
+    ) -> Dict[str, Exception]:
+        """Delete every key in the database that starts with a prefix, concurrently.
+
+        Args:
+            prefix (str): the prefix of the keys to delete. An empty prefix deletes every key.
+            concurrency (int, optional): How many keys to delete at once. Defaults to 16.
+
+        Returns:
+            Dict[str, Exception]: the error for every key that couldn't be deleted. Empty if they all were.
+        """
+        return await self.delete_many(await self.prefix(prefix), concurrency)
+
+    async def __delete_keys(
+        self, keys: List[str], concurrency: int
+    ) -> Dict[str, Exception]:
+        failed: Dict[str, Exception] = {}
+        semaphore = asyncio.Semaphore(max(concurrency, 1))
+
+        async def delete(key: str) -> None:
+            async with semaphore:
+                try:
+                    res = await self.http.delete(f"/{key}")
+                    if res.status_code != 404:
+                        res.raise_for_status()
+                except Exception as e:
+                    failed[key] = e
+
+        try:
+            await asyncio.gather(*map(delete, keys))
+        finally:
+            self._reads.wrote(keys)
+        return failed
+
+    async def flush(self) -> None:
+        """Send every buffered write to the database. Does nothing if write-behind is off."""
+        if self._buffer is None:
+            return
+        if self._buffer.flush_lock is None:
+            self._buffer.flush_lock = asyncio.Lock()
+        async with self._buffer.flush_lock:
+            sets, deletes = self._buffer.drain()
+            try:
+                try:
+                    if sets:
+                        self.__keep_encoded(sets, await self._post(sets))
+                except BaseException:
+                    self._buffer.restore(sets, deletes)
+                    raise
+                try:
+                    failed = await self.__delete_keys(deletes, 16)
+                except BaseException:
+                    self._buffer.restore({}, deletes)
+                    raise
+                if len(failed) < len(deletes) and self._coherence is not None:
+                    await self._post(
+                        {}, deleted=[key for key in deletes if key not in failed]
+                    )
+                if failed:
+                    self._buffer.restore({}, list(failed))
+                    raise next(iter(failed.values()))
+            finally:
+                # writes that failed are pending again, and the rest have landed
+                self._buffer.settle()
+
+    def __start_flusher(self) -> None:
+        # the task can only be created once there is a running event loop
+        if self._buffer.worker is None:  # type: ignore
+            self._buffer.worker = asyncio.create_task(self.__flush_loop())  # type: ignore
+
+    async def __flush_loop(self) -> None:
+        buffer: WriteBuffer = self._buffer  # type: ignore
+        while not buffer.stopped.is_set():
+            await asyncio.sleep(buffer.interval)
+            try:
+                await self.flush()
+            except Exception:
+                # the writes are back in the buffer, so they'll be retried next time
+                pass
+
+    async def sync_changes(self) -> int:
+        """Drop the keys other processes changed from the cache, and apply them to the key index. Runs in the background
+        every interval when coherence is on; call it to catch up right away.
+
+        Returns:
+            int: how many cached keys were dropped.
+        """
+        coherence = self._coherence
+        if coherence is None:
+            return 0
+        dropped = 0
+        for writer in coherence.writers(
+            [key async for key in self.__stream_keys(PREFIX)]
+        ):
+            res = await self.http.get(f"/{journal_key(writer)}")
+            if res.status_code == 404:
+                # expired since the listing
+                continue
+            res.raise_for_status()
+            changed = coherence.changed(writer, self._codec.decode(res.content))
+            # reads in flight may have been answered before the change
+            self._reads.wrote(changed)
+            if changed is None:
+                dropped += len(self._cache)
+                self._cache.clear()
+                if self._keys is not None:
+                    self._keys.invalidate()
+                continue
+            dropped += sum(
+                self._cache.pop(key, MISSING) is not MISSING for key in changed
+            )
+            if self._keys is not None:
+                self._keys.add(key for key, exists in changed.items() if exists)
+                self._keys.discard_many(
+                    key for key, exists in changed.items() if not exists
+                )
+        outdated = coherence.expired()
+        if outdated:
+            await self.__delete_keys(outdated, 16)
+        coherence.invalidations += dropped
+        return dropped
+
+    async def __poll_loop(self) -> None:
+        coherence: Coherence = self._coherence  # type: ignore
+        while not coherence.stopped.is_set():
+            await asyncio.sleep(coherence.interval)
+            try:
+                await self.sync_changes()
+            except Exception:
+                # try again next time
+                pass
+
+    async def get_table(
+        self, table: str, page_size: Optional[int] = None, columnar: bool = False
+    ) -> Table:
         """Get a table from the database.
 
         Args:
             table (str): the table to get from the database.
+            page_size (Optional[int], optional): Split the table across keys of this many rows, so a mutation only rewrites the pages it touched. Existing single-key tables are converted. Defaults to None.
+            columnar (bool, optional): Keep the rows in a compact ColumnarRows store instead of a list of dicts, for large tables. Defaults to False.
 
         Raises:
             ValueError: if the table is not a valid table.
@@ -123,43 +751,166 @@ class Database:
         Returns:
             List[Dict[str, Any]]: the table from the database.
         """
-        if table not in await self.keys():
-            await self.set(table, [])
+        return await self._flights.do(
+            ("table", table, page_size, columnar),
+            lambda: self.__load_table(table, page_size, columnar),
+        )
 
-        data = await self.get(table)
+    async def __load_table(
+        self, table: str, page_size: Optional[int], columnar: bool
+    ) -> Table:
+        data = self.__cached(table)
+        # streamed rows are checked as they are decoded
+        checked = data is MISSING
+        if checked:
+            try:
+                data = await self.__fetch_table(table)
+            except ValueError:
+                raise ValueError(f"`{table}` is not a valid table.") from None
+        # new tables are written along with their catalog entry
+        create = data is None
+        if create:
+            data = manifest(page_size, 0) if page_size else []
+        convert = bool(page_size) and isinstance(data, (list, ColumnarRows))
+        paged = is_manifest(data)
+        if paged:
+            page_size = data["page_size"]  # type: ignore
+            pages = await self.get_many(
+                [page_key(table, page) for page in range(data["pages"])]  # type: ignore
+            )
+            if columnar:
+                # keep the cached pages compact too
+                for key, page in pages.items():
+                    if isinstance(page, list):
+                        self._cache[key] = ColumnarRows(page)
+            data = [row for page in pages.values() for row in page or []]
+            checked = False
+        if isinstance(data, ColumnarRows) and not columnar:
+            data = list(data)
         if isinstance(data, list):
-            for i in data:
-                if not isinstance(i, dict):
-                    raise ValueError(f"`{table}` is not a valid table.")
-        else:
+            if not checked:
+                for i in data:
+                    if not isinstance(i, dict):
+                        raise ValueError(f"`{table}` is not a valid table.")
+        elif not isinstance(data, ColumnarRows):
             raise ValueError(f"`{table}` is not a valid table.")
 
-        return Table(self, table, data or [])
+        if columnar and not isinstance(data, ColumnarRows):
+            data = ColumnarRows(data)
+            if not paged:
+                # cache the compact rows rather than the decoded list
+                self._cache[table] = data
+        loaded = Table(self, table, data, page_size)
+        if create or convert:
+            await loaded.save()
+        return loaded
+
+    async def drop_table(self, table: str) -> None:
+        """Delete a table from the database, including all of its pages.
+
+        Args:
+            table (str): the table to delete.
+        """
+        data = await self.get(table)
+        if is_manifest(data):
+            for page in range(data["pages"]):  # type: ignore
+                await self.delete(page_key(table, page))
+        await self.delete(table)
+        await self.delete(catalog_key(table))
 
     async def list_tables(self) -> List[str]:
-        """List all the tables from the database.
+        """List all the tables from the database, from the table catalog, in one small listing request.
+        Tables are catalogued as they are created, and drop_table removes them. A table deleted with delete()
+        instead stays listed until drop_table is called for it. Tables written before the catalog existed
+        are only listed once discover_tables has catalogued them.
 
         Returns:
             List[str]: all the tables from the database.
         """
-        data: List[str] = []
-        keys = await self.keys()
-        for key in keys:
-            if isinstance(key, list):
-                for value in await self.get(key):
-                    if not isinstance(value, dict):
-                        break
-                data.append(key)
+        return sorted(key[len(CATALOG) :] for key in await self.__listing(CATALOG))
+
+    async def catalog(self) -> Dict[str, Dict[str, Any]]:
+        """Get the table catalog: each table's row count, layout and the fields its rows have.
+        Each table's entry is written along with its mutations, and removed by drop_table.
 
-        return data
+        Returns:
+            Dict[str, Dict[str, Any]]: the catalog, by table name.
+        """
+        tables = await self.list_tables()
+        entries = await self.get_many(map(catalog_key, tables))
+        return {
+            table: entries[catalog_key(table)]
+            for table in tables
+            if isinstance(entries[catalog_key(table)], dict)
+        }
+
+    async def discover_tables(self) -> List[str]:
+        """Catalogue the tables written before the table catalog existed, so they are listed too.
+        Every key is read once, without caching it, so this only needs calling once, for older databases.
+
+        Returns:
+            List[str]: the tables that were catalogued.
+        """
+        keys = set(await self.__listing(""))
+        readable = [key for key in keys if not key.startswith(INTERNAL)]
+        semaphore = asyncio.Semaphore(16)
+
+        async def peek(key: str) -> Any:
+            async with semaphore:
+                return await self.__peek(key)
+
+        values = dict(zip(readable, await asyncio.gather(*map(peek, readable))))
+        found = {
+            table: record
+            for table, record in discover(values).items()
+            if catalog_key(table) not in keys
+        }
+        if found:
+            await self.set_bulk(
+                {catalog_key(table): record for table, record in found.items()}
+            )
+        return sorted(found)
+
+    async def __peek(self, key: str) -> Any:
+        res = await self.http.get(f"/{key}")
+        if res.status_code == 404:
+            return None
+        res.raise_for_status()
+        return self._codec.decode(res.content)
 
     async def close(self):
-        """Close the database connection."""
-        await self.http.aclose()
+        """Flush any buffered writes and close the database connection.
+        Transports that were passed in or shared are left open for the other databases using them.
+        """
+        if self._buffer is not None:
+            self._buffer.stopped.set()
+            if self._buffer.worker is not None:
+                self._buffer.worker.cancel()
+            await self.flush()
+        if self._coherence is not None:
+            self._coherence.stopped.set()
+            if self._coherence.worker is not None:
+                self._coherence.worker.cancel()
+        if self._prefetcher is not None and self._prefetcher.worker:
+            for task in list(self._prefetcher.worker):
+                task.cancel()
+        if self._owns_transport:
+            await self.http.aclose()
 
 
 class Table:
-    __slots__ = ("_cache", "db", "name", "data")
+    __slots__ = (
+        "_cache",
+        "db",
+        "name",
+        "data",
+        "page_size",
+        "_indexes",
+        "_pages",
+        "_dirty",
+        "_batching",
+        "_fields",
+    )
     """An object representing a table in the database.
     You should not need to create an instance of this class yourself.
     """
@@ -169,13 +920,89 @@ class Table:
         db: Database,
         name: str,
         data: List[Dict[str, Any]],
+        page_size: Optional[int] = None,
     ):
         self.db = db
         self.name = name
         self.data = data
+        self.page_size = page_size
+        self._indexes: Dict[str, Index] = {}
+        # how many pages are stored remotely, and which need rewriting
+        self._pages = page_count(len(data), page_size) if page_size else 0
+        self._dirty: Set[int] = set()
+        self._batching = False
+        self._fields = set(sample_fields(data))
+
+    def _entry(self) -> Dict[str, Any]:
+        return entry(len(self.data), self.page_size, self._fields)
 
     async def __on_mutate(self):
-        await self.db.set(self.name, self.data)
+        if self._batching:
+            return
+        metrics = self.db._metrics
+        if not self.page_size:
+            if metrics is not None:
+                metrics.mutation(self.name, len(self.data))
+            await self.db.set_bulk(
+                {self.name: self.data, catalog_key(self.name): self._entry()}
+            )
+            return
+        pages = page_count(len(self.data), self.page_size)
+        payload: Dict[str, Any] = dump_pages(
+            self.name, self.data, self.page_size, (p for p in self._dirty if p < pages)
+        )
+        if metrics is not None:
+            metrics.mutation(self.name, sum(map(len, payload.values())), len(payload))
+        payload[self.name] = manifest(self.page_size, len(self.data))
+        payload[catalog_key(self.name)] = self._entry()
+        await self.db.set_bulk(payload)
+        for page in range(pages, self._pages):
+            await self.db.delete(page_key(self.name, page))
+        self._pages = pages
+        self._dirty.clear()
+
+    def __touch(self, position: int, through_end: bool = False) -> None:
+        if not self.page_size:
+            return
+        first = position // self.page_size
+        if through_end:
+            last = max(self._pages, page_count(len(self.data), self.page_size))
+        else:
+            last = first + 1
+        self._dirty.update(range(first, last))
+
+    @asynccontextmanager
+    async def batch(self) -> AsyncIterator[Table]:
+        """Group mutations into a single write.
+        Inside the block, changes are only made in memory. They are written once when it exits,
+        or rolled back if it raises.
+
+        Yields:
+            Table: this table.
+        """
+        if self._batching:
+            yield self
+            return
+        original, dirty = self.data, set(self._dirty)
+        snapshot = original.copy()
+        self._batching = True
+        try:
+            yield self
+        except BaseException:
+            # restore the original list in place, since the cache holds it too
+            original[:] = snapshot
+            self.data, self._dirty = original, dirty
+            for index in self._indexes.values():
+                index.rebuild(self.data)
+            raise
+        finally:
+            self._batching = False
+        await self.__on_mutate()
+
+    async def save(self) -> None:
+        """Write the whole table to the database."""
+        self.__touch(0, through_end=True)
+        await self.__on_mutate()
 
     async def delete(self, **filters) -> None:
         """Delete an existing document in the table.
@@ -183,11 +1010,18 @@ class Table:
         Args:
             **filters: Filters that the document must match.
         """
-        self.data = [
-            doc
-            for doc in self.data
-            if not any(doc.get(query, False) for query in filters)
-        ]
+        if not filters:
+            return
+        doomed = set(find(self.data, self._indexes, filters))
+        if not doomed:
+            return
+        self.__touch(min(doomed), through_end=True)
+        if isinstance(self.data, ColumnarRows):
+            self.data.drop(doomed)
+        else:
+            self.data = [doc for p, doc in enumerate(self.data) if p not in doomed]
+        for index in self._indexes.values():
+            index.rebuild(self.data)
         await self.__on_mutate()
 
     async def update(self, data: dict, **filters) -> None:
@@ -197,43 +1031,83 @@ class Table:
             data (dict): The new document data.
             **filters: Filters that the document must match.
         """
-        for index, doc in enumerate(self.data):
-            for query in filters:
-                if doc.get(query, False):
-                    self.data[index] = data
+        if not filters:
+            return
+        for position in find(self.data, self._indexes, filters):
+            for index in self._indexes.values():
+                index.remove(position, self.data[position])
+                index.add(position, data)
+            self.data[position] = data
+            self._fields.update(data)
+            self.__touch(position)
 
         await self.__on_mutate()
 
-    async def get(self, **filters) -> Optional[List[dict]]:
+    async def get(self, *where: Predicate, **filters) -> Optional[List[dict]]:
         """Gets all documents matching the given query.
 
         Args:
-            *text: The text to search for in the documents.
-            **filters: Filters that the document must match.
+            *where: Predicates the whole document must pass, or a compiled Query.
+            **filters: Filters that the document must match. See Query for the operators.
 
         Returns:
             List[dict]: Returns a list of documents matching the given query.
         """
-        filtered = filter_list(self.data, **filters)
-
-        if not filters:
-            return self.data
-        return filtered
+        if not filters and not where:
+            return self.data if isinstance(self.data, list) else list(self.data)
+        return list(self.scan(*where, **filters))
 
-    async def get_one(self, **filters) -> Optional[List[dict]]:
+    async def get_one(self, *where: Predicate, **filters) -> Optional[List[dict]]:
         """Gets the first document matching the given query.
 
         Args:
-            *args: The text to search for in the documents.
-            **filters: Filters that the document must match.
+            *where: Predicates the whole document must pass, or a compiled Query.
+            **filters: Filters that the document must match. See Query for the operators.
 
         Returns:
             dict: The document found.
         """
-        try:
-            return (await self.get(**filters))[0]  # type: ignore
-        except IndexError:
-            return None
+        return next(self.scan(*where, **filters), None)
+
+    def scan(self, *where: Predicate, **filters) -> Iterator[dict]:
+        """Lazily iterate over the documents matching a query, in table order.
+
+        Args:
+            *where: Predicates the whole document must pass, or a compiled Query.
+            **filters: Filters that the document must match. See Query for the operators.
+
+        Yields:
+            dict: Each matching document.
+        """
+        if len(where) == 1 and not filters and isinstance(where[0], Query):
+            query = where[0]
+        else:
+            query = Query(*where, **filters)
+        data = self.data
+        return (data[p] for p in select(data, self._indexes, query))
+
+    async def find(
+        self,
+        *where: Predicate,
+        limit: Optional[int] = None,
+        offset: int = 0,
+        fields: Optional[Iterable[str]] = None,
+        **filters,
+    ) -> List[dict]:
+        """Gets the documents matching a query, stopping as soon as `limit` are found.
+
+        Args:
+            *where: Predicates the whole document must pass, or a compiled Query.
+            limit (Optional[int], optional): The most documents to return. Defaults to None (all of them).
+            offset (int, optional): How many matching documents to skip. Defaults to 0.
+            fields (Optional[Iterable[str]], optional): Only include these fields in each document. Defaults to None (every field).
+            **filters: Filters that the document must match. See Query for the operators.
+
+        Returns:
+            List[dict]: The matching documents.
+        """
+        stop = offset + limit if limit is not None else None
+        return list(project(islice(self.scan(*where, **filters), offset, stop), fields))
 
     async def insert(self, data: dict) -> None:
         """Insert a new document into the table.
@@ -244,4 +1118,120 @@ class Table:
         if not isinstance(data, dict):
             raise TypeError("Data is not a dict object")
         self.data.append(data)
+        self._fields.update(data)
+        for index in self._indexes.values():
+            index.add(len(self.data) - 1, data)
+        self.__touch(len(self.data) - 1)
         await self.__on_mutate()
+
+    def create_index(self, field: str) -> None:
+        """Keep a hash index on a field, so filtering by it doesn't scan the whole table.
+        Indexes are kept up to date by insert, update and delete, so documents shouldn't be edited in place.
+
+        Args:
+            field (str): the field to index.
+        """
+        if field not in self._indexes:
+            self._indexes[field] = HashIndex(field, self.data)
+
+    def create_sorted_index(self, field: str) -> None:
+        """Keep a sorted index on a field, for range filters and ordered reads in O(log n + k).
+        It answers equality filters too, so it replaces a hash index on the same field.
+        Like hash indexes, it is kept up to date by insert, update and delete.
+
+        Args:
+            field (str): the field to index.
+        """
+        if not isinstance(self._indexes.get(field), SortedIndex):
+            self._indexes[field] = SortedIndex(field, self.data)
+
+    def ordered(
+        self,
+        field: str,
+        low: Any = None,
+        high: Any = None,
+        reverse: bool = False,
+        limit: Optional[int] = None,
+    ) -> Iterator[dict]:
+        """Lazily iterate over the documents in order of a field, optionally only those in a range.
+        Documents without the field, or where it is None, are left out.
+        Uses the field's sorted index, or sorts the table for this read if it has none.
+
+        Args:
+            field (str): the field to order by.
+            low (Any, optional): The smallest value to include. Defaults to None (no lower bound).
+            high (Any, optional): The largest value to include. Defaults to None (no upper bound).
+            reverse (bool, optional): Whether to start from the largest value. Defaults to False.
+            limit (Optional[int], optional): The most documents to return. Defaults to None (all of them).
+
+        Raises:
+            TypeError: if the field's values, or the bounds, can't be compared with each other.
+
+        Yields:
+            dict: Each document, in order.
+        """
+        index = self._indexes.get(field)
+        if not isinstance(index, SortedIndex):
+            index = SortedIndex(field, self.data)
+        if not index.complete:
+            raise TypeError(
+                f"`{field}` holds values that can't be compared with each other."
+            )
+        found = index.bounds(low, high)
+        if found is None:
+            raise TypeError(
+                f"The bounds can't be compared with the values of `{field}`."
+            )
+        start, end = found
+        if limit is not None:
+            if reverse:
+                start = max(start, end - limit)
+            else:
+                end = min(end, start + limit)
+        positions = index.positions[start:end]
+        if reverse:
+            positions.reverse()
+        data = self.data
+        return (data[p] for p in positions)
+
+    async def top_k(self, field: str, k: int) -> List[dict]:
+        """Gets the `k` documents with the largest values of a field, largest first.
+
+        Args:
+            field (str): the field to order by.
+            k (int): how many documents to get.
+
+        Returns:
+            List[dict]: The documents.
+        """
+        return list(self.ordered(field, reverse=True, limit=k))
+
+    async def first(self, field: str) -> Optional[dict]:
+        """Gets the document with the smallest value of a field.
+
+        Args:
+            field (str): the field to order by.
+
+        Returns:
+            Optional[dict]: The document, or None if no document has the field.
+        """
+        return next(self.ordered(field, limit=1), None)
+
+    async def last(self, field: str) -> Optional[dict]:
+        """Gets the document with the largest value of a field.
+
+        Args:
+            field (str): the field to order by.
+
+        Returns:
+            Optional[dict]: The document, or None if no document has the field.
+        """
+        return next(self.ordered(field, reverse=True, limit=1), None)
+
+    def drop_index(self, field: str) -> None:
+        """Stop indexing a field.
+
+        Args:
+            field (str): the indexed field.
+        """
+        self._indexes.pop(field, None)
@@ -0,0 +1,96 @@
+from __future__ import annotations
+from threading import Event, Lock
+from typing import Any, Dict, List, Tuple
+
+DELETED = object()
+"""Marks a key whose pending write is a delete."""
+
+
+class WriteBuffer:
+    """Holds writes in memory so they can be flushed to the database together.
+    Repeated writes to the same key are coalesced, so only the latest value is sent.
+
+    Args:
+        interval (float, optional): How many seconds to wait between background flushes. Defaults to 1.0.
+        max_size (int, optional): Flush as soon as this many keys are pending. Defaults to 100.
+    """
+
+    __slots__ = (
+        "interval",
+        "max_size",
+        "pending",
+        "flushing",
+        "stopped",
+        "worker",
+        "flush_lock",
+        "_lock",
+    )
+
+    def __init__(self, interval: float = 1.0, max_size: int = 100):
+        self.interval = interval
+        self.max_size = max_size
+        self.pending: Dict[str, Any] = {}
+        # drained writes the database hasn't acknowledged yet, which reads still see
+        self.flushing: Dict[str, Any] = {}
+        self.stopped = Event()
+        # set up by the client using the buffer
+        self.worker: Any = None
+        self.flush_lock: Any = None
+        self._lock = Lock()
+
+    def __len__(self) -> int:
+        return len(self.pending)
+
+    def get(self, key: str, default: Any = None) -> Any:
+        pending = self.pending
+        if key in pending:
+            return pending[key]
+        return self.flushing.get(key, default)
+
+    def add(self, data: Dict[str, Any]) -> bool:
+        """Queue values to be written.
+
+        Args:
+            data (Dict[str, Any]): the keys and values to write.
+
+        Returns:
+            bool: whether the buffer is full and should be flushed.
+        """
+        with self._lock:
+            self.pending.update(data)
+            return len(self.pending) >= self.max_size
+
+    def discard(self, key: str) -> bool:
+        """Queue a key to be deleted.
+
+        Returns:
+            bool: whether the buffer is full and should be flushed.
+        """
+        return self.add({key: DELETED})
+
+    def drain(self) -> Tuple[Dict[str, Any], List[str]]:
+        """Take everything that is pending out of the buffer. The writes stay visible until settle() is called.
+
+        Returns:
+            Tuple[Dict[str, Any], List[str]]: the values to set, and the keys to delete.
+        """
+        with self._lock:
+            # moved before it is replaced, so get() always finds a drained write in one or the other
+            pending = self.flushing = self.pending
+            self.pending = {}
+        sets = {k: v for k, v in pending.items() if v is not DELETED}
+        deletes = [k for k, v in pending.items() if v is DELETED]
+        return sets, deletes
+
+    def settle(self) -> None:
+        """Forget the drained writes, once the database has acknowledged them or they have been restored."""
+        with self._lock:
+            self.flushing = {}
+
+    def restore(self, sets: Dict[str, Any], deletes: List[str]) -> None:
+        """Put writes that failed to flush back, unless they have been superseded since."""
+        with self._lock:
+            for key in deletes:
+                self.pending.setdefault(key, DELETED)
+            for key, value in sets.items():
+                self.pending.setdefault(key, value)
@@ -0,0 +1,517 @@
+from __future__ import annotations
+from collections import OrderedDict
+from collections.abc import MutableMapping
+from json import dumps, loads
+from sqlite3 import connect
+from sys import getsizeof
+from threading import RLock
+from time import monotonic, time
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple, Union
+from .codec import Codec, encodable
+from .util import MISSING
+
+
+def approximate_size(value: Any) -> int:
+    """Roughly estimate how many bytes a decoded value occupies in memory.
+
+    Args:
+        value (Any): the value to measure.
+
+    Returns:
+        int: the approximate size of the value and everything it contains.
+    """
+    size = getsizeof(value)
+    if isinstance(value, dict):
+        for k, v in value.items():
+            size += approximate_size(k) + approximate_size(v)
+    elif isinstance(value, (list, tuple, set, frozenset)):
+        for i in value:
+            size += approximate_size(i)
+    return size
+
+
+class LRUCache(MutableMapping):
+    """A bounded, thread-safe cache that evicts the least recently used keys.
+
+    Args:
+        max_entries (Optional[int], optional): The maximum number of keys to hold. Defaults to None (unbounded).
+        max_bytes (Optional[int], optional): The maximum approximate size of all the values held. Values are only measured when it is set. Defaults to None (unbounded).
+        ttl (Optional[float], optional): How many seconds a value stays valid for. Defaults to None (forever).
+        sizeof (Callable[[Any], int], optional): The function used to measure a value. Defaults to approximate_size.
+    """
+
+    __slots__ = (
+        "max_entries",
+        "max_bytes",
+        "ttl",
+        "sizeof",
+        "hits",
+        "misses",
+        "evictions",
+        "currsize",
+        "_data",
+        "_lock",
+    )
+
+    def __init__(
+        self,
+        max_entries: Optional[int] = None,
+        max_bytes: Optional[int] = None,
+        ttl: Optional[float] = None,
+        sizeof: Callable[[Any], int] = approximate_size,
+    ):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.sizeof = sizeof
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.currsize = 0
+        # key -> [value, size, expires_at]
+        self._data: OrderedDict[str, List[Any]] = OrderedDict()
+        self._lock = RLock()
+
+    def __getitem__(self, key: str) -> Any:
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None or self.__expired(key, entry):
+                self.misses += 1
+                raise KeyError(key)
+            self._data.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def __setitem__(self, key: str, value: Any) -> None:
+        self.set(key, value)
+
+    def __delitem__(self, key: str) -> None:
+        with self._lock:
+            entry = self._data.pop(key)
+            self.currsize -= entry[1]
+
+    def pop(self, key: str, default: Any = MISSING) -> Any:  # type: ignore[override]
+        """Drop a key and get its value, without counting it as a hit or a miss."""
+        with self._lock:
+            entry = self._data.pop(key, None)
+            if entry is not None:
+                self.currsize -= entry[1]
+                if entry[2] is None or entry[2] > monotonic():
+                    return entry[0]
+        if default is MISSING:
+            raise KeyError(key)
+        return default
+
+    def __contains__(self, key: object) -> bool:
+        with self._lock:
+            entry = self._data.get(key)  # type: ignore
+            return entry is not None and not self.__expired(key, entry)  # type: ignore
+
+    def __iter__(self) -> Iterator[str]:
+        self.expire()
+        with self._lock:
+            return iter(list(self._data))
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def __expired(self, key: str, entry: List[Any]) -> bool:
+        if entry[2] is None or entry[2] > monotonic():
+            return False
+        del self._data[key]
+        self.currsize -= entry[1]
+        return True
+
+    def set(self, key: str, value: Any, ttl: Optional[float] = None) -> None:
+        """Store a value in the cache, evicting old keys if it is full.
+
+        Args:
+            key (str): the key to store the value under.
+            value (Any): the value to store.
+            ttl (Optional[float], optional): How many seconds this value stays valid for. Defaults to the cache's ttl.
+        """
+        ttl = ttl if ttl is not None else self.ttl
+        # values are only measured when there's a byte budget to keep to
+        size = self.sizeof(value) if self.max_bytes is not None else 0
+        with self._lock:
+            old = self._data.pop(key, None)
+            if old is not None:
+                self.currsize -= old[1]
+            self._data[key] = [
+                value,
+                size,
+                monotonic() + ttl if ttl is not None else None,
+            ]
+            self.currsize += size
+            self.__evict()
+
+    def __evict(self) -> None:
+        while self._data and (
+            (self.max_entries is not None and len(self._data) > self.max_entries)
+            or (self.max_bytes is not None and self.currsize > self.max_bytes)
+        ):
+            _, entry = self._data.popitem(last=False)
+            self.currsize -= entry[1]
+            self.evictions += 1
+
+    def expire(self) -> None:
+        """Drop every value whose ttl has run out."""
+        with self._lock:
+            for key, entry in list(self._data.items()):
+                self.__expired(key, entry)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._data.clear()
+            self.currsize = 0
+
+    @property
+    def hit_rate(self) -> float:
+        """The fraction of lookups that were served from the cache."""
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+    def stats(self) -> Dict[str, Any]:
+        """Get the cache's counters.
+
+        Returns:
+            Dict[str, Any]: the hits, misses, evictions, hit rate, size and byte size of the cache.
+        """
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_rate": self.hit_rate,
+            "entries": len(self._data),
+            "bytes": self.currsize,
+        }
+
+    def reset_stats(self) -> None:
+        """Reset the hit, miss and eviction counters."""
+        self.hits = self.misses = self.evictions = 0
+
+
+class RawCache(MutableMapping):
+    """A cache that keeps values as the compact bytes they are stored as, and only decodes them when they are read.
+    JSON with lots of dicts takes several times more memory as Python objects than as bytes,
+    so this holds far more keys in the same memory, especially after populate_cache().
+
+    The most recently read values are also kept decoded, up to a budget, so hot keys aren't decoded on every read.
+    Values set locally also keep the bytes they were written as, so they are only encoded here if they leave that tier before being written.
+
+    Args:
+        max_bytes (Optional[int], optional): The most raw bytes to hold. The least recently used keys are evicted beyond it. Defaults to None (unbounded).
+        decoded_bytes (Optional[int], optional): The approximate size of the decoded values kept, as measured by `sizeof`. Values are only measured when it is set. Defaults to 8 MiB. None keeps every value read decoded.
+        codec (Optional[Codec], optional): The codec the values are stored with. Defaults to the codec of the Database using the cache.
+        sizeof (Callable[[Any], int], optional): The function used to measure a decoded value. Defaults to approximate_size.
+    """
+
+    __slots__ = (
+        "max_bytes",
+        "decoded_bytes",
+        "codec",
+        "sizeof",
+        "hits",
+        "misses",
+        "decodes",
+        "evictions",
+        "raw_size",
+        "decoded_size",
+        "_raw",
+        "_decoded",
+        "_lock",
+    )
+
+    def __init__(
+        self,
+        max_bytes: Optional[int] = None,
+        decoded_bytes: Optional[int] = 8 << 20,
+        codec: Optional[Codec] = None,
+        sizeof: Callable[[Any], int] = approximate_size,
+    ):
+        self.max_bytes = max_bytes
+        self.decoded_bytes = decoded_bytes
+        self.codec = codec
+        self.sizeof = sizeof
+        self.hits = 0
+        self.misses = 0
+        self.decodes = 0
+        self.evictions = 0
+        self.raw_size = 0
+        self.decoded_size = 0
+        # every key is held raw, decoded, or both. Both are in least recently used order
+        self._raw: OrderedDict[str, bytes] = OrderedDict()
+        self._decoded: OrderedDict[str, Tuple[Any, int]] = OrderedDict()
+        self._lock = RLock()
+
+    def __getitem__(self, key: str) -> Any:
+        with self._lock:
+            entry = self._decoded.get(key)
+            raw = self._raw.get(key)
+            if entry is not None:
+                self._decoded.move_to_end(key)
+                if raw is not None:
+                    self._raw.move_to_end(key)
+                self.hits += 1
+                return entry[0]
+            if raw is None:
+                self.misses += 1
+                raise KeyError(key)
+            self._raw.move_to_end(key)
+            self.hits += 1
+        value = self.__codec().decode(raw)
+        with self._lock:
+            # unless the key changed while it was being decoded
+            if self._raw.get(key) is raw and key not in self._decoded:
+                self.decodes += 1
+                self.__keep_decoded(key, value)
+                self.__evict()
+        return value
+
+    def __setitem__(self, key: str, value: Any) -> None:
+        size = self.__size(value)
+        with self._lock:
+            self.__drop(key)
+            self._decoded[key] = (value, size)
+            self.decoded_size += size
+            self.__evict()
+
+    def store(self, key: str, raw: Union[str, bytes], value: Any = MISSING) -> None:
+        """Store a value as the bytes it is stored as in the database.
+
+        Args:
+            key (str): the key to store the value under.
+            raw (Union[str, bytes]): the stored value.
+            value (Any, optional): The value already decoded, if it was. Defaults to MISSING.
+        """
+        raw = raw.encode() if isinstance(raw, str) else bytes(raw)
+        with self._lock:
+            self.__drop(key)
+            self._raw[key] = raw
+            self.raw_size += len(raw)
+            if value is not MISSING:
+                self.__keep_decoded(key, value)
+            self.__evict()
+
+    def keep_raw(self, key: str, raw: Union[str, bytes], value: Any) -> None:
+        """Keep the stored form of a value that was set locally, so it isn't encoded again when it leaves the decoded tier.
+        Does nothing if the key has since changed, or was evicted.
+
+        Args:
+            key (str): the key the value was set under.
+            raw (Union[str, bytes]): the value as it was sent to the database.
+            value (Any): the value that was set.
+        """
+        raw = raw.encode() if isinstance(raw, str) else bytes(raw)
+        with self._lock:
+            entry = self._decoded.get(key)
+            if entry is None or entry[0] is not value or key in self._raw:
+                return
+            self._raw[key] = raw
+            self.raw_size += len(raw)
+            self.__evict()
+
+    def __size(self, value: Any) -> int:
+        return 0 if self.decoded_bytes is None else self.sizeof(value)
+
+    def __keep_decoded(self, key: str, value: Any) -> None:
+        size = self.__size(value)
+        self._decoded[key] = (value, size)
+        self.decoded_size += size
+
+    def __drop(self, key: str) -> bool:
+        raw = self._raw.pop(key, None)
+        if raw is not None:
+            self.raw_size -= len(raw)
+        entry = self._decoded.pop(key, None)
+        if entry is not None:
+            self.decoded_size -= entry[1]
+        return raw is not None or entry is not None
+
+    def __evict(self) -> None:
+        while (
+            self._decoded
+            and self.decoded_bytes is not None
+            and self.decoded_size > self.decoded_bytes
+        ):
+            key, (value, size) = self._decoded.popitem(last=False)
+            self.decoded_size -= size
+            if key not in self._raw:
+                # values that were set locally, and not yet written, have no raw form
+                raw = self.__codec().encode(value).encode()
+                self._raw[key] = raw
+                self._raw.move_to_end(key, last=False)
+                self.raw_size += len(raw)
+        while (
+            self._raw and self.max_bytes is not None and self.raw_size > self.max_bytes
+        ):
+            key, raw = self._raw.popitem(last=False)
+            self.raw_size -= len(raw)
+            entry = self._decoded.pop(key, None)
+            if entry is not None:
+                self.decoded_size -= entry[1]
+            self.evictions += 1
+
+    def __codec(self) -> Codec:
+        if self.codec is None:
+            self.codec = Codec()
+        return self.codec
+
+    def __delitem__(self, key: str) -> None:
+        with self._lock:
+            if not self.__drop(key):
+                raise KeyError(key)
+
+    def pop(self, key: str, default: Any = MISSING) -> Any:  # type: ignore[override]
+        """Drop a key, without decoding it. Returns None rather than its value if it was held raw."""
+        with self._lock:
+            entry = self._decoded.get(key)
+            if self.__drop(key):
+                return entry[0] if entry is not None else None
+        if default is MISSING:
+            raise KeyError(key)
+        return default
+
+    def __contains__(self, key: object) -> bool:
+        with self._lock:
+            return key in self._decoded or key in self._raw
+
+    def __iter__(self) -> Iterator[str]:
+        with self._lock:
+            return iter(list(dict.fromkeys([*self._raw, *self._decoded])))
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._raw) + sum(
+                1 for key in self._decoded if key not in self._raw
+            )
+
+    def clear(self) -> None:
+        with self._lock:
+            self._raw.clear()
+            self._decoded.clear()
+            self.raw_size = self.decoded_size = 0
+
+    @property
+    def currsize(self) -> int:
+        """The approximate memory held by the cache: the raw bytes plus the decoded values."""
+        return self.raw_size + self.decoded_size
+
+    @property
+    def hit_rate(self) -> float:
+        """The fraction of lookups that were served from the cache."""
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+    def stats(self) -> Dict[str, Any]:
+        """Get the cache's counters and memory usage.
+
+        Returns:
+            Dict[str, Any]: the hits, misses, decodes, evictions, hit rate, number of keys, and bytes held raw, decoded and in total.
+        """
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "decodes": self.decodes,
+                "evictions": self.evictions,
+                "hit_rate": self.hit_rate,
+                "entries": len(self),
+                "decoded_entries": len(self._decoded),
+                "raw_bytes": self.raw_size,
+                "decoded_bytes": self.decoded_size,
+                "bytes": self.currsize,
+            }
+
+    def reset_stats(self) -> None:
+        """Reset the hit, miss, decode and eviction counters."""
+        self.hits = self.misses = self.decodes = self.evictions = 0
+
+
+class DiskCache(MutableMapping):
+    """A cache persisted to an sqlite file, so a restarted process starts warm.
+    Values are stored as JSON, along with when they were stored.
+
+    Args:
+        path (str): The file to keep the cache in. It is created if it doesn't exist.
+        max_age (Optional[float], optional): How many seconds a stored value is trusted for before it is refetched. Defaults to None (forever).
+    """
+
+    __slots__ = ("path", "max_age", "_db", "_lock")
+
+    def __init__(self, path: str, max_age: Optional[float] = None):
+        self.path = path
+        self.max_age = max_age
+        self._db = connect(path, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS cache (key TEXT PRIMARY KEY, value TEXT, stored REAL)"
+        )
+        self._db.commit()
+        self._lock = RLock()
+
+    def __oldest(self) -> float:
+        return time() - self.max_age if self.max_age is not None else float("-inf")
+
+    def __getitem__(self, key: str) -> Any:
+        with self._lock:
+            row = self._db.execute(
+                "SELECT value FROM cache WHERE key = ? AND stored >= ?",
+                (key, self.__oldest()),
+            ).fetchone()
+        if row is None:
+            raise KeyError(key)
+        return loads(row[0])
+
+    def __setitem__(self, key: str, value: Any) -> None:
+        self.update({key: value})
+
+    def __delitem__(self, key: str) -> None:
+        with self._lock:
+            deleted = self._db.execute("DELETE FROM cache WHERE key = ?", (key,))
+            self._db.commit()
+        if not deleted.rowcount:
+            raise KeyError(key)
+
+    def __contains__(self, key: object) -> bool:
+        with self._lock:
+            return (
+                self._db.execute(
+                    "SELECT 1 FROM cache WHERE key = ? AND stored >= ?",
+                    (key, self.__oldest()),
+                ).fetchone()
+                is not None
+            )
+
+    def __iter__(self) -> Iterator[str]:
+        with self._lock:
+            rows = self._db.execute("SELECT key FROM cache").fetchall()
+        return (row[0] for row in rows)
+
+    def __len__(self) -> int:
+        with self._lock:
+            return self._db.execute("SELECT COUNT(*) FROM cache").fetchone()[0]
+
+    def update(self, data: Any = (), **kwargs: Any) -> None:  # type: ignore
+        """Store many values in one transaction."""
+        stored = time()
+        rows = [
+            (k, dumps(v, default=encodable), stored)
+            for k, v in dict(data, **kwargs).items()
+        ]
+        with self._lock:
+            self._db.executemany(
+                "INSERT OR REPLACE INTO cache (key, value, stored) VALUES (?, ?, ?)",
+                rows,
+            )
+            self._db.commit()
+
+    def clear(self) -> None:
+        with self._lock:
+            self._db.execute("DELETE FROM cache")
+            self._db.commit()
+
+    def close(self) -> None:
+        """Close the cache file."""
+        with self._lock:
+            self._db.close()
@@ -0,0 +1,73 @@
+from __future__ import annotations
+from itertools import islice
+from typing import Any, Dict, Iterable, List, Optional
+from .pages import is_manifest, page_key
+
+CATALOG = "__repltable_tables__:"
+"""Prefix of the keys holding each table's catalog entry. Each table has its own, so writers never overwrite each other's."""
+
+
+def catalog_key(table: str) -> str:
+    return f"{CATALOG}{table}"
+
+
+SAMPLE = 100
+"""How many rows the schema hint of a table is taken from when it is loaded."""
+
+
+def sample_fields(rows: Iterable[Dict[str, Any]]) -> List[str]:
+    """Collect the fields of a table's first rows, as a hint of its schema."""
+    fields = getattr(rows, "fields", None)
+    if fields is not None:
+        # columnar rows already know every field
+        return sorted(fields)
+    seen: Dict[str, None] = {}
+    for row in islice(rows, SAMPLE):
+        seen.update(dict.fromkeys(row))
+    return sorted(seen)
+
+
+def entry(rows: int, page_size: Optional[int], fields: Iterable[str]) -> Dict[str, Any]:
+    """Build a table's entry in the catalog.
+
+    Args:
+        rows (int): how many rows the table has.
+        page_size (Optional[int]): the table's page size, if it is paged.
+        fields (Iterable[str]): the fields its rows are known to have.
+
+    Returns:
+        Dict[str, Any]: the entry.
+    """
+    return {
+        "rows": rows,
+        "layout": "paged" if page_size else "list",
+        "page_size": page_size,
+        "fields": sorted(fields),
+    }
+
+
+def discover(values: Dict[str, Any]) -> Dict[str, Dict[str, Any]]:
+    """Build a catalog from the values of every key, for databases written before it existed.
+
+    Args:
+        values (Dict[str, Any]): every key in the database, with its value.
+
+    Returns:
+        Dict[str, Dict[str, Any]]: the catalog, by table name.
+    """
+    catalog: Dict[str, Dict[str, Any]] = {}
+    pages = set()
+    for key, value in values.items():
+        if is_manifest(value):
+            keys = [page_key(key, page) for page in range(value["pages"])]
+            pages.update(keys)
+            first = values.get(keys[0]) if keys else None
+            catalog[key] = entry(
+                value["rows"], value["page_size"], sample_fields(first or [])
+            )
+    for key, value in values.items():
+        if key in pages or key in catalog or not isinstance(value, list):
+            continue
+        if all(isinstance(row, dict) for row in value):
+            catalog[key] = entry(len(value), None, sample_fields(value))
+    return catalog
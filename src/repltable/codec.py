@@ -0,0 +1,164 @@
+from __future__ import annotations
+import json
+import re
+import zlib
+from base64 import b64decode, b64encode
+from math import isfinite
+from typing import Any, Optional, Union
+
+try:
+    import orjson  # type: ignore
+except ImportError:  # pragma: no cover
+    orjson = None
+
+try:
+    import zstandard  # type: ignore
+except ImportError:  # pragma: no cover
+    zstandard = None
+
+from .columnar import ColumnarRows
+
+MARKERS = {"zlib": "repltable:zlib:", "zstd": "repltable:zstd:"}
+"""Prefixes marking a value as compressed, and with what."""
+
+
+# integers orjson reads exactly fit in 64 bits, so anything longer, or more negative, may not
+_LONG_NUMBER = re.compile(r"\d{20}|-\d{19}")
+_LONG_NUMBER_BYTES = re.compile(rb"\d{20}|-\d{19}")
+
+
+def loads(data: Union[str, bytes]) -> Any:
+    """Parse JSON, with orjson when it is installed and reads the value exactly.
+    orjson reads integers wider than 64 bits as floats, and can't read NaN,
+    so those values are left to the standard library.
+
+    Raises:
+        ValueError: if the data isn't JSON.
+    """
+    if orjson is not None:
+        pattern = _LONG_NUMBER if isinstance(data, str) else _LONG_NUMBER_BYTES
+        if pattern.search(data) is None:  # type: ignore[arg-type]
+            try:
+                return orjson.loads(data)
+            except ValueError:
+                pass
+    return json.loads(data)
+
+
+def non_finite(value: Any) -> bool:
+    """Whether a value holds NaN or an infinity anywhere, which orjson writes as null."""
+    stack = [value]
+    while stack:
+        item = stack.pop()
+        kind = type(item)
+        if kind is float:
+            if not isfinite(item):
+                return True
+        elif kind is dict:
+            stack.extend(item.values())
+        elif kind is list or kind is tuple or kind is ColumnarRows:
+            stack.extend(item)
+    return False
+
+
+def encodable(value: Any) -> Any:
+    """Turn values JSON can't encode natively, like columnar rows, into ones it can."""
+    if isinstance(value, ColumnarRows):
+        return list(value)
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+
+class Codec:
+    """Turns values into the strings stored in the database, and back.
+    Values are JSON, using orjson when it is installed. Large values can be compressed;
+    compressed values are marked, so plain values written before still decode.
+
+    Args:
+        compression (Optional[str], optional): "zlib", or "zstd" (needs `zstandard`), to compress large values with. Defaults to None.
+        compress_over (int, optional): Only compress values whose JSON is longer than this many bytes. Defaults to 4096.
+        level (Optional[int], optional): The compression level. Defaults to the compressor's default.
+
+    Raises:
+        ValueError: if the compression isn't supported.
+    """
+
+    __slots__ = ("compression", "compress_over", "level", "_marker")
+
+    def __init__(
+        self,
+        compression: Optional[str] = None,
+        compress_over: int = 4096,
+        level: Optional[int] = None,
+    ):
+        if compression is not None and compression not in MARKERS:
+            raise ValueError(f"`{compression}` is not a supported compression.")
+        if compression == "zstd" and zstandard is None:
+            raise ValueError("zstd compression needs the `zstandard` package.")
+        self.compression = compression
+        self.compress_over = compress_over
+        self.level = level
+        self._marker = MARKERS.get(compression or "", "")
+
+    def dumps(self, value: Any) -> bytes:
+        """Encode a value as JSON. Values orjson can't write exactly, like integers wider than 64 bits
+        or NaN (which it writes as null), are written by the standard library instead.
+        """
+        if orjson is not None:
+            try:
+                raw = orjson.dumps(
+                    value, default=encodable, option=orjson.OPT_NON_STR_KEYS
+                )
+            except TypeError:
+                pass
+            else:
+                # null is usually just None, so the value is only searched when it is there
+                if b"null" not in raw or not non_finite(value):
+                    return raw
+        return json.dumps(value, separators=(",", ":"), default=encodable).encode()
+
+    def encode(self, value: Any) -> str:
+        """Encode a value into the string to store.
+
+        Args:
+            value (Any): the value to encode.
+
+        Returns:
+            str: the JSON, or the marked, compressed JSON if it is large enough.
+        """
+        raw = self.dumps(value)
+        if not self.compression or len(raw) <= self.compress_over:
+            return raw.decode()
+        if self.compression == "zstd":
+            packed = zstandard.ZstdCompressor(level=self.level or 3).compress(raw)
+        else:
+            packed = zlib.compress(raw, self.level if self.level is not None else -1)
+        return self._marker + b64encode(packed).decode()
+
+    def decode(self, data: Union[str, bytes]) -> Any:
+        """Decode a stored value. Values that aren't JSON are returned as text.
+
+        Args:
+            data (Union[str, bytes]): the stored value.
+
+        Returns:
+            Any: the decoded value.
+        """
+        text = data.decode() if isinstance(data, bytes) else data
+        if text.startswith("repltable:"):
+            for compression, marker in MARKERS.items():
+                if text.startswith(marker):
+                    data = self.__decompress(compression, text[len(marker) :])
+                    break
+        try:
+            return loads(data)
+        except ValueError:
+            return text
+
+    @staticmethod
+    def __decompress(compression: str, text: str) -> bytes:
+        packed = b64decode(text)
+        if compression == "zlib":
+            return zlib.decompress(packed)
+        if zstandard is None:
+            raise ValueError("Decoding zstd values needs the `zstandard` package.")
+        return zstandard.ZstdDecompressor().decompress(packed)
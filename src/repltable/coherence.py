@@ -0,0 +1,166 @@
+from __future__ import annotations
+from collections import deque
+from threading import Event, Lock
+from time import monotonic
+from typing import Any, Deque, Dict, Iterable, List, Optional, Tuple
+from uuid import uuid4
+
+PREFIX = "__repltable_changes__:"
+"""Prefix of the journal key each writer records the keys it changed under."""
+
+
+def journal_key(writer: str) -> str:
+    return f"{PREFIX}{writer}"
+
+
+class Coherence:
+    """Keeps a Database's cache coherent with writes made by other processes.
+
+    Every write also records the changed keys in the writer's journal, a single key it overwrites
+    in the same request as the values, so journalling costs no extra requests. In the background,
+    each Database lists the journals once per interval, reads them, and drops just the keys changed
+    since it last read them from its cache, and applies them to its key index. Cached values are
+    so at most about one interval stale. Each journal holds its writer's last few changes.
+    Journals that haven't changed for `retention` seconds, like those of processes that have exited,
+    are deleted by the readers that see them.
+
+    Args:
+        interval (float, optional): How many seconds to wait between polls. Defaults to 1.0.
+        history (int, optional): How many of its latest writes each journal holds. A reader that falls further behind clears its whole cache. Defaults to 32.
+        max_keys (int, optional): The most keys a journal lists. Larger writes make readers clear their whole cache instead. Defaults to 1000.
+        retention (float, optional): How many seconds another writer's journal is kept after it last changed. Defaults to 3600.0.
+    """
+
+    __slots__ = (
+        "interval",
+        "history",
+        "max_keys",
+        "retention",
+        "writer",
+        "epoch",
+        "seen",
+        "invalidations",
+        "stopped",
+        "worker",
+        "_recent",
+        "_sightings",
+        "_lock",
+    )
+
+    def __init__(
+        self,
+        interval: float = 1.0,
+        history: int = 32,
+        max_keys: int = 1000,
+        retention: float = 3600.0,
+    ):
+        self.interval = interval
+        self.history = history
+        self.max_keys = max_keys
+        self.retention = retention
+        self.writer = uuid4().hex[:16]
+        self.epoch = 0
+        # the latest epoch read from every other writer
+        self.seen: Dict[str, int] = {}
+        self.invalidations = 0
+        self.stopped = Event()
+        # set up by the client polling for changes
+        self.worker: Any = None
+        self._recent: Deque[Tuple[int, Optional[Tuple[List[str], List[str]]]]] = deque(
+            maxlen=history
+        )
+        # the latest epoch of every other writer, and when it was first seen
+        self._sightings: Dict[str, Tuple[int, float]] = {}
+        self._lock = Lock()
+
+    def record(
+        self, keys: Iterable[str], deleted: Iterable[str] = ()
+    ) -> Dict[str, Any]:
+        """Record a write, and build the journal entry to write along with it.
+
+        Args:
+            keys (Iterable[str]): the keys that were set.
+            deleted (Iterable[str], optional): the keys that were deleted. Defaults to ().
+
+        Returns:
+            Dict[str, Any]: the journal key and its value.
+        """
+        sets = [key for key in keys if not key.startswith(PREFIX)]
+        deletes = list(deleted)
+        with self._lock:
+            self.epoch += 1
+            small = len(sets) + len(deletes) <= self.max_keys
+            self._recent.append((self.epoch, (sets, deletes) if small else None))
+            changes = None
+            if all(change is not None for _, change in self._recent):
+                entries = [[epoch, *change] for epoch, change in self._recent]  # type: ignore[misc]
+                if sum(len(s) + len(d) for _, s, d in entries) <= self.max_keys:
+                    changes = entries
+            return {journal_key(self.writer): {"epoch": self.epoch, "changes": changes}}
+
+    def writers(self, keys: Iterable[str]) -> List[str]:
+        """Find the other writers, from a listing of the journal keys.
+
+        Args:
+            keys (Iterable[str]): the journal keys.
+
+        Returns:
+            List[str]: every other writer with a journal.
+        """
+        writers = [
+            key[len(PREFIX) :]
+            for key in keys
+            if key.startswith(PREFIX) and key != journal_key(self.writer)
+        ]
+        # writers whose journals are gone start over if they come back
+        for writer in self._sightings.keys() - set(writers):
+            del self._sightings[writer]
+        return writers
+
+    def changed(self, writer: str, journal: Any) -> Optional[Dict[str, bool]]:
+        """Read another writer's journal, and mark it as seen.
+
+        Args:
+            writer (str): the writer.
+            journal (Any): the journal's value.
+
+        Returns:
+            Optional[Dict[str, bool]]: the keys changed since it was last read, and whether each one still exists, or None if that isn't known and the whole cache should be cleared.
+        """
+        epoch = journal.get("epoch") if isinstance(journal, dict) else None
+        if not isinstance(epoch, int):
+            return {}
+        sighting = self._sightings.get(writer)
+        if sighting is None or sighting[0] != epoch:
+            self._sightings[writer] = (epoch, monotonic())
+        last = self.seen.get(writer, 0)
+        if epoch <= last:
+            return {}
+        self.seen[writer] = epoch
+        changes = journal.get("changes")
+        if changes is None or changes[0][0] > last + 1:
+            # the writer made more writes since than its journal still holds
+            return None
+        changed: Dict[str, bool] = {}
+        for e, sets, deletes in changes:
+            if e > last:
+                changed.update(dict.fromkeys(sets, True))
+                changed.update(dict.fromkeys(deletes, False))
+        return changed
+
+    def expired(self) -> List[str]:
+        """Find the journals that haven't changed for `retention` seconds, and forget them.
+
+        Returns:
+            List[str]: the journal keys to delete.
+        """
+        now = monotonic()
+        # a journal is only removed once every live reader has long since read it
+        expired = [
+            writer
+            for writer, (_, since) in self._sightings.items()
+            if now - since >= self.retention
+        ]
+        for writer in expired:
+            del self._sightings[writer]
+        return [journal_key(writer) for writer in expired]
@@ -0,0 +1,236 @@
+from __future__ import annotations
+from array import array
+from collections.abc import MutableSequence
+from sys import intern
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Tuple, Union
+from .query import Query, value_test
+from .util import MISSING
+
+Column = Union["array[Any]", List[Any]]
+
+_INT_RANGE = range(-(2**63), 2**63)
+
+
+def _column(values: List[Any]) -> Column:
+    # numbers go in a typed array when every row has one of the same type
+    kinds = set(map(type, values))
+    if kinds == {int}:
+        try:
+            return array("q", values)
+        except OverflowError:
+            pass
+    elif kinds == {float}:
+        return array("d", values)
+    return [intern(v) if type(v) is str else v for v in values]
+
+
+def _fits(column: Column, value: Any) -> bool:
+    if not isinstance(column, array):
+        return True
+    if column.typecode == "q":
+        return type(value) is int and value in _INT_RANGE
+    return type(value) is float
+
+
+class ColumnarRows(MutableSequence):
+    """A compact, column-per-field store for a table's rows, used instead of a list of dicts.
+    Numeric fields that every row has are kept in typed arrays, other fields in lists with
+    interned strings. Documents are built only when they are read, so changing a document
+    that was read doesn't change the table.
+
+    Args:
+        rows (Iterable[Dict[str, Any]], optional): The rows to store. Defaults to none.
+    """
+
+    __slots__ = ("_columns", "_length")
+
+    def __init__(self, rows: Iterable[Dict[str, Any]] = ()):
+        self._columns: Dict[str, Column] = {}
+        self._length = 0
+        self.__load(rows if isinstance(rows, list) else list(rows))
+
+    def __load(self, rows: List[Dict[str, Any]]) -> None:
+        fields: Dict[str, None] = {}
+        for row in rows:
+            fields.update(dict.fromkeys(row))
+        self._columns = {
+            field: _column([row.get(field, MISSING) for row in rows])
+            for field in fields
+        }
+        self._length = len(rows)
+
+    @classmethod
+    def _from_columns(cls, columns: Dict[str, Column], length: int) -> ColumnarRows:
+        rows = cls()
+        rows._columns, rows._length = columns, length
+        return rows
+
+    @property
+    def fields(self) -> List[str]:
+        """The fields any row has had, in the order they were first seen."""
+        return list(self._columns)
+
+    def __len__(self) -> int:
+        return self._length
+
+    def __position(self, position: int) -> int:
+        if position < 0:
+            position += self._length
+        if not 0 <= position < self._length:
+            raise IndexError("table index out of range")
+        return position
+
+    def __row(self, position: int) -> Dict[str, Any]:
+        row = {}
+        for field, column in self._columns.items():
+            value = column[position]
+            if value is not MISSING:
+                row[field] = value
+        return row
+
+    def __getitem__(self, position):  # type: ignore[override]
+        if isinstance(position, slice):
+            columns = {f: column[position] for f, column in self._columns.items()}
+            return self._from_columns(columns, len(range(self._length)[position]))
+        return self.__row(self.__position(position))
+
+    def __iter__(self) -> Iterator[Dict[str, Any]]:
+        if not self._columns:
+            return iter([{} for _ in range(self._length)])
+        fields = tuple(self._columns)
+        return (
+            {f: v for f, v in zip(fields, values) if v is not MISSING}
+            for values in zip(*self._columns.values())
+        )
+
+    def __store(self, field: str, position: int, value: Any) -> None:
+        column = self._columns.get(field)
+        if column is None:
+            column = self._columns[field] = [MISSING] * self._length
+        elif not _fits(column, value):
+            column = self._columns[field] = list(column)
+        column[position] = intern(value) if type(value) is str else value
+
+    def __setitem__(self, position, row) -> None:  # type: ignore[override]
+        if isinstance(position, slice):
+            rows = list(self)
+            rows[position] = row
+            self.__load(rows)
+            return
+        position = self.__position(position)
+        for field in self._columns:
+            self.__store(field, position, row.get(field, MISSING))
+        for field, value in row.items():
+            self.__store(field, position, value)
+
+    def __delitem__(self, position) -> None:  # type: ignore[override]
+        if not isinstance(position, slice):
+            position = self.__position(position)
+        removed = (
+            len(range(self._length)[position]) if isinstance(position, slice) else 1
+        )
+        for column in self._columns.values():
+            del column[position]
+        self._length -= removed
+
+    def insert(self, position: int, row: Dict[str, Any]) -> None:
+        position = min(
+            max(position + self._length if position < 0 else position, 0), self._length
+        )
+        for field, column in self._columns.items():
+            value = row.get(field, MISSING)
+            if not _fits(column, value):
+                column = self._columns[field] = list(column)
+            column.insert(position, intern(value) if type(value) is str else value)
+        self._length += 1
+        for field, value in row.items():
+            if field not in self._columns:
+                self.__store(field, position, value)
+
+    def __eq__(self, other: object) -> bool:
+        if isinstance(other, (ColumnarRows, list)):
+            return len(self) == len(other) and all(a == b for a, b in zip(self, other))
+        return NotImplemented
+
+    def __repr__(self) -> str:
+        return f"ColumnarRows({list(self)!r})"
+
+    def copy(self) -> ColumnarRows:
+        columns = {f: column[:] for f, column in self._columns.items()}
+        return self._from_columns(columns, self._length)
+
+    def drop(self, positions: Iterable[int]) -> None:
+        """Delete the rows at some positions in one pass.
+
+        Args:
+            positions (Iterable[int]): the positions of the rows to delete.
+        """
+        doomed = set(positions)
+        for field, column in self._columns.items():
+            kept = (v for p, v in enumerate(column) if p not in doomed)
+            if isinstance(column, array):
+                self._columns[field] = array(column.typecode, kept)
+            else:
+                self._columns[field] = list(kept)
+        self._length -= len({p for p in doomed if 0 <= p < self._length})
+
+    def matching(
+        self, query: Query, candidates: Optional[Iterable[int]] = None
+    ) -> Iterator[int]:
+        """Lazily find the positions of the rows matching a query, testing the columns
+        directly, so only rows that have to be given to a `where` predicate are built.
+
+        Args:
+            query (Query): the compiled query.
+            candidates (Optional[Iterable[int]], optional): Only test these positions. Defaults to every row.
+
+        Yields:
+            int: the position of each matching row.
+        """
+        tests: List[Tuple[Column, Callable[[Any], bool]]] = []
+        for field, op, value in query.conditions:
+            column = self._columns.get(field)
+            if op == "exists":
+                if column is not None:
+                    wanted = bool(value)
+                    tests.append((column, lambda v, w=wanted: (v is not MISSING) is w))
+                elif value:
+                    return iter(())
+                continue
+            if column is None:
+                return iter(())
+            test = value_test(op, value)
+            if not isinstance(column, array):
+                test = _present(test)
+            tests.append((column, test))
+        where = query.where
+        positions = range(self._length) if candidates is None else candidates
+
+        def scan() -> Iterator[int]:
+            for p in positions:
+                for column, test in tests:
+                    if not test(column[p]):
+                        break
+                else:
+                    if where:
+                        row = self.__row(p)
+                        if not all(predicate(row) for predicate in where):
+                            continue
+                    yield p
+
+        return scan()
+
+
+def _present(test: Callable[[Any], bool]) -> Callable[[Any], bool]:
+    # rows without the field never match
+    def check(value: Any) -> bool:
+        return value is not MISSING and test(value)
+
+    return check
+
+
+def plain(value: Any) -> Any:
+    """Turn columnar rows back into the list of dicts they hold, so they read like any other value.
+    Other values are returned as they are.
+    """
+    return list(value) if isinstance(value, ColumnarRows) else value
@@ -0,0 +1,176 @@
+from __future__ import annotations
+import asyncio
+from concurrent.futures import Future
+from threading import Lock
+from typing import Any, Awaitable, Callable, Dict, Hashable, Iterable, Optional, TypeVar
+
+T = TypeVar("T")
+
+
+class SingleFlight:
+    """Shares one call between every thread asking for the same thing at the same time,
+    so a burst of misses on a hot key makes a single request.
+    """
+
+    __slots__ = ("_calls", "_lock")
+
+    def __init__(self):
+        self._calls: Dict[Hashable, Future] = {}
+        self._lock = Lock()
+
+    def __len__(self) -> int:
+        return len(self._calls)
+
+    def do(self, key: Hashable, call: Callable[[], T]) -> T:
+        """Make a call, or wait for the same call another thread is already making.
+
+        Args:
+            key (Hashable): what the call is for.
+            call (Callable[[], T]): the call.
+
+        Returns:
+            T: the call's result, which is shared with every thread that waited for it.
+        """
+        with self._lock:
+            future = self._calls.get(key)
+            leader = future is None
+            if leader:
+                future = self._calls[key] = Future()
+        if not leader:
+            return future.result()
+        try:
+            result = call()
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        else:
+            future.set_result(result)
+            return result
+        finally:
+            with self._lock:
+                del self._calls[key]
+
+
+class AsyncSingleFlight:
+    """Shares one call between every coroutine asking for the same thing at the same time.
+    The call runs as its own task, so cancelling one of the waiters doesn't cancel it for the rest.
+    """
+
+    __slots__ = ("_calls",)
+
+    def __init__(self):
+        self._calls: Dict[Hashable, asyncio.Future] = {}
+
+    def __len__(self) -> int:
+        return len(self._calls)
+
+    async def do(self, key: Hashable, call: Callable[[], Awaitable[T]]) -> T:
+        """Make a call, or wait for the same call another coroutine is already making.
+
+        Args:
+            key (Hashable): what the call is for.
+            call (Callable[[], Awaitable[T]]): the call.
+
+        Returns:
+            T: the call's result, which is shared with every coroutine that waited for it.
+        """
+        task = self._calls.get(key)
+        if task is None:
+            task = self._calls[key] = asyncio.ensure_future(call())
+
+            def done(finished: Any) -> None:
+                if self._calls.get(key) is finished:
+                    del self._calls[key]
+                if not finished.cancelled():
+                    # mark the error as seen, even if every waiter was cancelled
+                    finished.exception()
+
+            task.add_done_callback(done)
+        return await asyncio.shield(task)
+
+
+class Read:
+    """A read of one key, begun with ReadGuard.read. Used as a context manager, it ends when the block does.
+
+    Args:
+        guard (ReadGuard): the guard tracking the read.
+        key (str): the key being read.
+        started (int): how many local writes to the key the guard had seen when the read began.
+    """
+
+    __slots__ = ("guard", "key", "started", "store")
+
+    def __init__(self, guard: ReadGuard, key: str, started: int):
+        self.guard = guard
+        self.key = key
+        self.started = started
+        # what to do with the response, if no local write overtook it
+        self.store: Optional[Callable[[], Any]] = None
+
+    def __enter__(self) -> Read:
+        return self
+
+    def __exit__(self, *exc: Any) -> None:
+        if exc[0] is not None:
+            self.store = None
+        self.close()
+
+    def close(self) -> None:
+        """End the read, storing its response unless the key was written locally while it was in flight."""
+        self.guard._finish(self)
+
+
+class ReadGuard:
+    """Counts the local writes to each key while reads of it are in flight, so a response that may
+    be older than one of those writes isn't cached over it. Only keys being read are tracked.
+    """
+
+    __slots__ = ("_reads", "_writes", "_lock")
+
+    def __init__(self):
+        self._reads: Dict[str, int] = {}
+        self._writes: Dict[str, int] = {}
+        self._lock = Lock()
+
+    def generation(self, key: str) -> int:
+        """How many local writes to a key have landed while it was being read."""
+        return self._writes.get(key, 0)
+
+    def read(self, key: str) -> Read:
+        """Begin reading a key. The read must be closed once the response is in.
+
+        Args:
+            key (str): the key to read.
+
+        Returns:
+            Read: the read.
+        """
+        with self._lock:
+            self._reads[key] = self._reads.get(key, 0) + 1
+            return Read(self, key, self._writes.get(key, 0))
+
+    def wrote(self, keys: Optional[Iterable[str]] = None) -> None:
+        """Record local writes, once they are visible to reads.
+
+        Args:
+            keys (Optional[Iterable[str]], optional): the keys written. Defaults to None (every key).
+        """
+        with self._lock:
+            for key in self._reads if keys is None else keys:
+                if key in self._reads:
+                    self._writes[key] = self._writes.get(key, 0) + 1
+
+    def _finish(self, read: Read) -> None:
+        with self._lock:
+            key = read.key
+            try:
+                # stored under the lock, so a write can't land between the check and the store
+                if read.store is not None and self._writes.get(key, 0) == read.started:
+                    read.store()
+            finally:
+                left = self._reads[key] - 1
+                if left:
+                    self._reads[key] = left
+                else:
+                    del self._reads[key]
+                    self._writes.pop(key, None)
@@ -0,0 +1,286 @@
+from __future__ import annotations
+from bisect import bisect_left, bisect_right, insort
+from typing import Any, Dict, Iterator, List, Optional, Tuple, Union
+from .columnar import ColumnarRows
+from .query import Query
+from .util import MISSING
+
+
+class HashIndex:
+    """An in-memory hash index mapping a field's values to the rows that hold them.
+    Rows are tracked by their position in the table, so lookups come back in table order.
+
+    Args:
+        field (str): the field to index.
+        data (List[Dict[str, Any]]): the rows to build the index from.
+    """
+
+    __slots__ = ("field", "buckets")
+
+    def __init__(self, field: str, data: List[Dict[str, Any]]):
+        self.field = field
+        self.buckets: Dict[Any, List[int]] = {}
+        self.rebuild(data)
+
+    def rebuild(self, data: List[Dict[str, Any]]) -> None:
+        """Rebuild the whole index, for when rows have moved."""
+        self.buckets = {}
+        for position, doc in enumerate(data):
+            self.add(position, doc)
+
+    def add(self, position: int, doc: Dict[str, Any]) -> None:
+        try:
+            bucket = self.buckets.setdefault(doc[self.field], [])
+        except (KeyError, TypeError):
+            # rows without the field, or with an unhashable value, can't be indexed
+            return
+        if not bucket or bucket[-1] < position:
+            bucket.append(position)
+        else:
+            insort(bucket, position)
+
+    def remove(self, position: int, doc: Dict[str, Any]) -> None:
+        try:
+            bucket = self.buckets[doc[self.field]]
+        except (KeyError, TypeError):
+            return
+        bucket.remove(position)
+        if not bucket:
+            del self.buckets[doc[self.field]]
+
+    def lookup(self, value: Any) -> Optional[List[int]]:
+        """Get the positions of the rows where the field equals a value.
+
+        Returns:
+            Optional[List[int]]: the positions, or None if the value can't be looked up in the index.
+        """
+        try:
+            return self.buckets.get(value, [])
+        except TypeError:
+            return None
+
+
+class SortedIndex:
+    """An in-memory index keeping a field's values in sorted order, with the positions of their rows.
+    It answers equality lookups like a HashIndex, and also ranges and ordered reads, with a binary search.
+    Rows without the field, or where it is None, aren't indexed. The field should hold one kind of value,
+    like numbers or strings: while some values can't be compared with the rest, the index is incomplete,
+    and queries scan the table instead. It is complete again once those values are gone.
+
+    Args:
+        field (str): the field to index.
+        data (List[Dict[str, Any]]): the rows to build the index from.
+    """
+
+    __slots__ = ("field", "values", "positions", "skipped")
+
+    def __init__(self, field: str, data: List[Dict[str, Any]]):
+        self.field = field
+        # sorted by value, then position
+        self.values: List[Any] = []
+        self.positions: List[int] = []
+        # the rows whose values couldn't be compared with the rest, by position
+        self.skipped: Dict[int, Any] = {}
+        self.rebuild(data)
+
+    def __len__(self) -> int:
+        return len(self.positions)
+
+    @property
+    def complete(self) -> bool:
+        """Whether every row with a value is in the index, so it can answer queries."""
+        return not self.skipped
+
+    def rebuild(self, data: List[Dict[str, Any]]) -> None:
+        """Rebuild the whole index, for when rows have moved."""
+        field = self.field
+        self.skipped = {}
+        entries = [
+            (doc[field], position)
+            for position, doc in enumerate(data)
+            if doc.get(field) is not None
+        ]
+        try:
+            entries.sort()
+        except TypeError:
+            # mixed types, so index whichever values compare with the ones before them and skip the rest
+            self.values, self.positions = [], []
+            for position, doc in enumerate(data):
+                self.add(position, doc)
+            return
+        self.values = [value for value, _ in entries]
+        self.positions = [position for _, position in entries]
+
+    def __find(self, value: Any, position: int) -> int:
+        # where a row belongs among the rows sharing its value
+        low = bisect_left(self.values, value)
+        high = bisect_right(self.values, value, low)
+        return bisect_left(self.positions, position, low, high)
+
+    def add(self, position: int, doc: Dict[str, Any]) -> None:
+        value = doc.get(self.field)
+        if value is not None and not self.__insert(position, value):
+            self.skipped[position] = value
+
+    def __insert(self, position: int, value: Any) -> bool:
+        try:
+            at = self.__find(value, position)
+        except TypeError:
+            return False
+        self.values.insert(at, value)
+        self.positions.insert(at, position)
+        return True
+
+    def remove(self, position: int, doc: Dict[str, Any]) -> None:
+        value = doc.get(self.field)
+        if value is None:
+            return
+        if self.skipped.pop(position, MISSING) is MISSING:
+            at = self.__find(value, position)
+            if at < len(self.positions) and self.positions[at] == position:
+                del self.values[at]
+                del self.positions[at]
+        # the value that conflicted with the skipped ones may be gone now
+        for skipped, kept in list(self.skipped.items()):
+            if self.__insert(skipped, kept):
+                del self.skipped[skipped]
+
+    def lookup(self, value: Any) -> Optional[List[int]]:
+        """Get the positions of the rows where the field equals a value, in table order.
+
+        Returns:
+            Optional[List[int]]: the positions, or None if the value can't be looked up in the index.
+        """
+        if value is None:
+            # None isn't indexed, and would mean an unbounded range
+            return None
+        return self.range(value, value)
+
+    def bounds(
+        self,
+        low: Any = None,
+        high: Any = None,
+        include_low: bool = True,
+        include_high: bool = True,
+    ) -> Optional[Tuple[int, int]]:
+        """Find the slice of the index holding the values in a range, in O(log n).
+
+        Args:
+            low (Any, optional): The smallest value. Defaults to None (no lower bound).
+            high (Any, optional): The largest value. Defaults to None (no upper bound).
+            include_low (bool, optional): Whether values equal to `low` are in the range. Defaults to True.
+            include_high (bool, optional): Whether values equal to `high` are in the range. Defaults to True.
+
+        Returns:
+            Optional[Tuple[int, int]]: the start and end of the slice, or None if the bounds can't be compared with the values, or the index is incomplete.
+        """
+        if self.skipped:
+            return None
+        try:
+            start = (
+                0
+                if low is None
+                else (bisect_left if include_low else bisect_right)(self.values, low)
+            )
+            end = (
+                len(self.values)
+                if high is None
+                else (bisect_right if include_high else bisect_left)(
+                    self.values, high, start
+                )
+            )
+        except TypeError:
+            return None
+        return start, max(start, end)
+
+    def range(self, *args: Any, **kwargs: Any) -> Optional[List[int]]:
+        """Get the positions of the rows with values in a range, in table order.
+        Takes the same arguments as `bounds`.
+
+        Returns:
+            Optional[List[int]]: the positions, or None if the bounds can't be compared with the values.
+        """
+        found = self.bounds(*args, **kwargs)
+        if found is None:
+            return None
+        return sorted(self.positions[found[0] : found[1]])
+
+
+Index = Union[HashIndex, SortedIndex]
+
+_RANGES: Dict[str, Any] = {
+    "gt": lambda value: {"low": value, "include_low": False},
+    "gte": lambda value: {"low": value},
+    "lt": lambda value: {"high": value, "include_high": False},
+    "lte": lambda value: {"high": value},
+    "between": lambda value: {"low": value[0], "high": value[1]},
+}
+
+
+def _candidates(indexes: Dict[str, Index], query: Query) -> Optional[List[int]]:
+    # the fewest rows any index narrows the query down to, or None if none of them apply
+    candidates: Optional[List[int]] = None
+    for field, value in query.equalities.items():
+        index = indexes.get(field)
+        if index is None:
+            continue
+        positions = index.lookup(value)
+        if positions is not None and (
+            candidates is None or len(positions) < len(candidates)
+        ):
+            candidates = positions
+    for field, op, value in query.conditions:
+        index = indexes.get(field)
+        if op not in _RANGES or not isinstance(index, SortedIndex):
+            continue
+        try:
+            found = index.bounds(**_RANGES[op](value))
+        except (TypeError, IndexError):
+            # a malformed `between`, which the predicate rejects on its own
+            continue
+        if found is not None and (
+            candidates is None or found[1] - found[0] < len(candidates)
+        ):
+            candidates = sorted(index.positions[found[0] : found[1]])
+    return candidates
+
+
+def select(
+    data: List[Dict[str, Any]], indexes: Dict[str, Index], query: Query
+) -> Iterator[int]:
+    """Lazily find the positions of the rows matching a query, in table order.
+    The most selective index on one of its equalities, or a sorted index on one of its ranges,
+    narrows down the candidates, otherwise every row is scanned. Columnar rows are tested column by column.
+
+    Args:
+        data (List[Dict[str, Any]]): the rows to search.
+        indexes (Dict[str, Index]): the indexes on the rows, by field.
+        query (Query): the compiled query.
+
+    Yields:
+        int: the position of each matching row.
+    """
+    candidates = _candidates(indexes, query)
+    if isinstance(data, ColumnarRows):
+        return data.matching(query, None if candidates is None else list(candidates))
+    predicate = query.predicate
+    if candidates is None:
+        return (p for p, doc in enumerate(data) if predicate(doc))
+    # copied, since the bucket may change while the caller iterates
+    return (p for p in list(candidates) if predicate(data[p]))
+
+
+def find(
+    data: List[Dict[str, Any]], indexes: Dict[str, Index], filters: Dict[str, Any]
+) -> List[int]:
+    """Find the positions of every row matching the filters.
+
+    Args:
+        data (List[Dict[str, Any]]): the rows to search.
+        indexes (Dict[str, Index]): the indexes on the rows, by field.
+        filters (Dict[str, Any]): the filters, as accepted by Query.
+
+    Returns:
+        List[int]: the positions of the matching rows, in table order.
+    """
+    return list(select(data, indexes, Query(**filters)))
@@ -0,0 +1,86 @@
+from __future__ import annotations
+from bisect import bisect_left
+from threading import RLock
+from time import monotonic
+from typing import Iterable, List, Optional
+
+
+class KeyIndex:
+    """A local, sorted index of the keys in the database, so listings don't need a request.
+    It is loaded from one full listing and kept up to date by the Database's own writes.
+    Writes from other processes aren't seen until it is refreshed, or, with coherence on, until the next poll.
+
+    Args:
+        max_age (Optional[float], optional): How many seconds the index is trusted for before it is reloaded. Defaults to None (until refresh_keys is called).
+    """
+
+    __slots__ = ("max_age", "loaded_at", "_keys", "_lock")
+
+    def __init__(self, max_age: Optional[float] = None):
+        self.max_age = max_age
+        self.loaded_at: Optional[float] = None
+        self._keys: List[str] = []
+        self._lock = RLock()
+
+    def __contains__(self, key: object) -> bool:
+        with self._lock:
+            i = bisect_left(self._keys, key)  # type: ignore
+            return i < len(self._keys) and self._keys[i] == key
+
+    def __len__(self) -> int:
+        return len(self._keys)
+
+    @property
+    def stale(self) -> bool:
+        """Whether the index has never been loaded, or is older than max_age."""
+        return self.loaded_at is None or (
+            self.max_age is not None and monotonic() - self.loaded_at > self.max_age
+        )
+
+    def invalidate(self) -> None:
+        """Mark the index as stale, so it is reloaded before it is next used."""
+        self.loaded_at = None
+
+    def load(self, keys: Iterable[str]) -> None:
+        """Replace the whole index with a fresh listing."""
+        keys = sorted(set(keys))
+        with self._lock:
+            self._keys = keys
+            self.loaded_at = monotonic()
+
+    def add(self, keys: Iterable[str]) -> None:
+        with self._lock:
+            for key in keys:
+                i = bisect_left(self._keys, key)
+                if i == len(self._keys) or self._keys[i] != key:
+                    self._keys.insert(i, key)
+
+    def discard(self, key: str) -> None:
+        with self._lock:
+            i = bisect_left(self._keys, key)
+            if i < len(self._keys) and self._keys[i] == key:
+                del self._keys[i]
+
+    def discard_many(self, keys: Iterable[str]) -> None:
+        """Remove many keys in one pass, rather than one O(n) removal each."""
+        doomed = set(keys)
+        if not doomed:
+            return
+        with self._lock:
+            self._keys = [key for key in self._keys if key not in doomed]
+
+    def prefix(self, prefix: str) -> List[str]:
+        """Get every key that starts with a prefix, in O(log n + k).
+
+        Args:
+            prefix (str): the prefix to search for.
+
+        Returns:
+            List[str]: the matching keys, sorted.
+        """
+        with self._lock:
+            start = bisect_left(self._keys, prefix)
+            end = start
+            while end < len(self._keys) and self._keys[end].startswith(prefix):
+                end += 1
+            return self._keys[start:end]
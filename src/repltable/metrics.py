@@ -0,0 +1,211 @@
+from __future__ import annotations
+from bisect import bisect_left
+from threading import Lock
+from time import perf_counter
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+
+from httpx import Request, Response
+
+BUCKETS: Tuple[float, ...] = (
+    0.001,
+    0.0025,
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1.0,
+    2.5,
+    5.0,
+    float("inf"),
+)
+"""The upper bounds, in seconds, of the latency histogram buckets."""
+
+Exporter = Callable[[Dict[str, Any]], Any]
+
+
+class Histogram:
+    """A fixed-bucket histogram of latencies."""
+
+    __slots__ = ("counts", "count", "total")
+
+    def __init__(self):
+        self.counts: List[int] = [0] * len(BUCKETS)
+        self.count = 0
+        self.total = 0.0
+
+    def observe(self, seconds: float) -> None:
+        self.counts[bisect_left(BUCKETS, seconds)] += 1
+        self.count += 1
+        self.total += seconds
+
+    def quantile(self, q: float) -> float:
+        """Estimate a quantile as the upper bound of the bucket it falls in.
+
+        Args:
+            q (float): the quantile, between 0 and 1.
+
+        Returns:
+            float: the estimated latency in seconds.
+        """
+        rank = q * self.count
+        seen = 0
+        for bound, count in zip(BUCKETS, self.counts):
+            seen += count
+            if seen >= rank and count:
+                return bound
+        return 0.0
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {
+            "count": self.count,
+            "sum": self.total,
+            "p50": self.quantile(0.5),
+            "p95": self.quantile(0.95),
+            "p99": self.quantile(0.99),
+            "buckets": dict(zip(map(str, BUCKETS), self.counts)),
+        }
+
+
+class Metrics:
+    """Records what a Database does on the wire, and passes every event on to exporters.
+    Pass an instance as `metrics=` to a Database to enable it.
+
+    Each event is a dict with a "type" of "request", "cache" or "mutation":
+        - request: op (get, prefix, set_bulk or delete), method, status, seconds until the response headers arrived, sent and received bytes.
+        - cache: key and hit.
+        - mutation: table, rows written and pages written.
+
+    Args:
+        exporters (Iterable[Callable[[Dict[str, Any]], Any]], optional): Callbacks called with every event. Defaults to ().
+    """
+
+    __slots__ = (
+        "exporters",
+        "latency",
+        "statuses",
+        "sent",
+        "received",
+        "hits",
+        "misses",
+        "mutations",
+        "rows_written",
+        "_lock",
+    )
+
+    def __init__(self, exporters: Iterable[Exporter] = ()):
+        self.exporters: List[Exporter] = list(exporters)
+        self.latency: Dict[str, Histogram] = {}
+        self.statuses: Dict[int, int] = {}
+        self.sent = 0
+        self.received = 0
+        self.hits = 0
+        self.misses = 0
+        self.mutations = 0
+        self.rows_written = 0
+        self._lock = Lock()
+
+    def __emit(self, event: Dict[str, Any]) -> None:
+        for exporter in self.exporters:
+            exporter(event)
+
+    def request(
+        self,
+        op: str,
+        method: str,
+        status: int,
+        seconds: float,
+        sent: int = 0,
+        received: int = 0,
+    ) -> None:
+        """Record an HTTP request to the database."""
+        with self._lock:
+            histogram = self.latency.get(op)
+            if histogram is None:
+                histogram = self.latency[op] = Histogram()
+            histogram.observe(seconds)
+            self.statuses[status] = self.statuses.get(status, 0) + 1
+            self.sent += sent
+            self.received += received
+        if self.exporters:
+            self.__emit(
+                {
+                    "type": "request",
+                    "op": op,
+                    "method": method,
+                    "status": status,
+                    "seconds": seconds,
+                    "sent": sent,
+                    "received": received,
+                }
+            )
+
+    def cache(self, key: str, hit: bool) -> None:
+        """Record a cache lookup."""
+        with self._lock:
+            if hit:
+                self.hits += 1
+            else:
+                self.misses += 1
+        if self.exporters:
+            self.__emit({"type": "cache", "key": key, "hit": hit})
+
+    def mutation(self, table: str, rows: int, pages: int = 0) -> None:
+        """Record a table being written to the database."""
+        with self._lock:
+            self.mutations += 1
+            self.rows_written += rows
+        if self.exporters:
+            self.__emit(
+                {"type": "mutation", "table": table, "rows": rows, "pages": pages}
+            )
+
+    def snapshot(self) -> Dict[str, Any]:
+        """Get everything recorded so far.
+
+        Returns:
+            Dict[str, Any]: the latency histograms by operation, status code counts, bytes sent and received, cache hits and misses, and table writes.
+        """
+        with self._lock:
+            return {
+                "latency": {op: h.snapshot() for op, h in self.latency.items()},
+                "statuses": dict(self.statuses),
+                "sent": self.sent,
+                "received": self.received,
+                "hits": self.hits,
+                "misses": self.misses,
+                "mutations": self.mutations,
+                "rows_written": self.rows_written,
+            }
+
+    def on_request(self, request: Request) -> None:
+        request.extensions["repltable_start"] = perf_counter()
+
+    def on_response(self, response: Response) -> None:
+        request = response.request
+        start: Optional[float] = request.extensions.get("repltable_start")
+        self.request(
+            operation(request),
+            request.method,
+            response.status_code,
+            perf_counter() - start if start else 0.0,
+            int(request.headers.get("Content-Length", 0)),
+            int(response.headers.get("Content-Length", 0)),
+        )
+
+    async def aon_request(self, request: Request) -> None:
+        self.on_request(request)
+
+    async def aon_response(self, response: Response) -> None:
+        self.on_response(response)
+
+
+def operation(request: Request) -> str:
+    """Name the Database operation an HTTP request belongs to."""
+    if request.method == "POST":
+        return "set_bulk"
+    if request.method == "DELETE":
+        return "delete"
+    return "prefix" if b"prefix=" in request.url.query else "get"
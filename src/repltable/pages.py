@@ -0,0 +1,45 @@
+from __future__ import annotations
+from typing import Any, Dict, Iterable, List
+
+MARKER = "__repltable_pages__"
+"""Key that marks a table's value as the manifest of a paged table."""
+
+
+def page_key(table: str, page: int) -> str:
+    return f"{table}:page:{page}"
+
+
+def page_count(rows: int, page_size: int) -> int:
+    return -(-rows // page_size)
+
+
+def is_manifest(value: Any) -> bool:
+    return isinstance(value, dict) and MARKER in value
+
+
+def manifest(page_size: int, rows: int) -> Dict[str, Any]:
+    """Build the manifest stored under a paged table's own key.
+
+    Args:
+        page_size (int): how many rows each page holds.
+        rows (int): how many rows the table has.
+
+    Returns:
+        Dict[str, Any]: the manifest.
+    """
+    return {
+        MARKER: 1,
+        "page_size": page_size,
+        "rows": rows,
+        "pages": page_count(rows, page_size),
+    }
+
+
+def dump_pages(
+    table: str, data: List[Dict[str, Any]], page_size: int, pages: Iterable[int]
+) -> Dict[str, List[Dict[str, Any]]]:
+    """Slice the given pages out of a table's rows, keyed by their page keys."""
+    return {
+        page_key(table, page): data[page * page_size : (page + 1) * page_size]
+        for page in pages
+    }
@@ -0,0 +1,108 @@
+from __future__ import annotations
+from collections import OrderedDict
+from threading import Lock
+from time import monotonic
+from typing import Any, Callable, Iterable, Optional
+
+
+class Prefetcher:
+    """Reads the keys related to a key that missed the cache in the background,
+    so the reads that usually follow it hit the cache.
+
+    By default the keys related to `user:123:profile` are the other keys under `user:123:`,
+    found with one listing. A budget bounds how many prefetch requests are in flight at once,
+    and a group isn't read ahead again until its cooldown is over, so prefetching can't swamp the database.
+
+    Args:
+        delimiter (str, optional): Keys are grouped by everything up to the last delimiter. Defaults to ":".
+        related (Optional[Callable[[str], Iterable[str]]], optional): Names the keys to read ahead for a key, instead of listing its group. Defaults to None.
+        max_keys (int, optional): The most keys read ahead for one miss. Defaults to 16.
+        max_pending (int, optional): The most prefetch requests in flight at once. Reads over the budget are skipped. Defaults to 8.
+        cooldown (float, optional): How many seconds to wait before reading ahead for the same group again. Defaults to 30.0.
+    """
+
+    __slots__ = (
+        "delimiter",
+        "related",
+        "max_keys",
+        "max_pending",
+        "cooldown",
+        "pending",
+        "prefetched",
+        "skipped",
+        "worker",
+        "_groups",
+        "_lock",
+    )
+
+    def __init__(
+        self,
+        delimiter: str = ":",
+        related: Optional[Callable[[str], Iterable[str]]] = None,
+        max_keys: int = 16,
+        max_pending: int = 8,
+        cooldown: float = 30.0,
+    ):
+        self.delimiter = delimiter
+        self.related = related
+        self.max_keys = max_keys
+        self.max_pending = max_pending
+        self.cooldown = cooldown
+        self.pending = 0
+        self.prefetched = 0
+        self.skipped = 0
+        # set up by the client doing the prefetching
+        self.worker: Any = None
+        self._groups: OrderedDict[str, float] = OrderedDict()
+        self._lock = Lock()
+
+    def group(self, key: str) -> Optional[str]:
+        """Get the prefix a key's related keys share, or None if it has none."""
+        head, delimiter, _ = key.rpartition(self.delimiter)
+        return head + delimiter if delimiter else None
+
+    def claim(self, key: str) -> bool:
+        """Decide whether to read ahead for a key that missed the cache.
+
+        Args:
+            key (str): the key that missed.
+
+        Returns:
+            bool: whether its group should be read ahead, and the budget was reserved to do so.
+        """
+        group = key if self.related is not None else self.group(key)
+        if group is None:
+            return False
+        now = monotonic()
+        with self._lock:
+            last = self._groups.get(group)
+            if last is not None and now - last < self.cooldown:
+                return False
+            if self.pending >= self.max_pending:
+                # left for a later miss, rather than suppressed for the whole cooldown
+                self.skipped += 1
+                return False
+            self.pending += 1
+            self._groups[group] = now
+            self._groups.move_to_end(group)
+            while len(self._groups) > 1024:
+                self._groups.popitem(last=False)
+        return True
+
+    def reserve(self, count: int) -> int:
+        """Take up to `count` requests from the budget.
+
+        Returns:
+            int: how many were granted. The rest should be skipped.
+        """
+        with self._lock:
+            granted = max(0, min(count, self.max_pending - self.pending))
+            self.pending += granted
+            self.skipped += count - granted
+            return granted
+
+    def release(self, prefetched: int = 0) -> None:
+        """Give a request back to the budget once it is done."""
+        with self._lock:
+            self.pending -= 1
+            self.prefetched += prefetched
@@ -0,0 +1,116 @@
+from __future__ import annotations
+from operator import contains, eq, ge, gt, le, lt, ne
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+
+Predicate = Callable[[Dict[str, Any]], bool]
+
+OPERATORS: Dict[str, Callable[[Any, Any], bool]] = {
+    "eq": eq,
+    "ne": ne,
+    "gt": gt,
+    "gte": ge,
+    "lt": lt,
+    "lte": le,
+    "in": lambda value, options: value in options,
+    "nin": lambda value, options: value not in options,
+    "contains": contains,
+    "startswith": lambda value, prefix: value.startswith(prefix),
+    "between": lambda value, bounds: bounds[0] <= value <= bounds[1],
+}
+"""The operators a filter can use, as `field__operator=value`. `exists` is also supported."""
+
+
+def _parse(name: str) -> Tuple[str, str]:
+    field, _, op = name.rpartition("__")
+    if not field or (op not in OPERATORS and op != "exists"):
+        return name, "eq"
+    return field, op
+
+
+def value_test(op: str, value: Any) -> Callable[[Any], bool]:
+    """Compile one filter into a test on a field's value, for fields that are present.
+    `exists` tests on presence rather than a value, so it isn't accepted here.
+    """
+    if op == "eq" and callable(value):
+        return lambda field_value: bool(value(field_value))
+    compare = OPERATORS[op]
+
+    def check(field_value: Any) -> bool:
+        try:
+            return bool(compare(field_value, value))
+        except (TypeError, AttributeError):
+            # values of a different type never match
+            return False
+
+    return check
+
+
+def _condition(field: str, op: str, value: Any) -> Predicate:
+    if op == "exists":
+        wanted = bool(value)
+        return lambda doc: (field in doc) is wanted
+    if op == "eq" and not callable(value):
+        item = (field, value)
+        return lambda doc: item in doc.items()
+    test = value_test(op, value)
+    return lambda doc: field in doc and test(doc[field])
+
+
+class Query:
+    """A query compiled once into a single predicate, so it can be reused cheaply.
+
+    Filters are `field=value` for equality, `field=callable` to test the field's value,
+    or `field__operator=value` with one of: eq, ne, gt, gte, lt, lte, in, nin, contains,
+    startswith, between (an inclusive (low, high) pair), and exists (True or False).
+
+    Args:
+        *where (Callable[[Dict[str, Any]], bool]): Predicates the whole document must pass.
+        **filters: Filters that the document must match.
+    """
+
+    __slots__ = ("filters", "equalities", "conditions", "where", "predicate")
+
+    def __init__(self, *where: Predicate, **filters: Any):
+        self.filters = filters
+        # plain equalities can be answered by hash indexes
+        self.equalities: Dict[str, Any] = {}
+        # the parsed filters, as (field, operator, value), for stores that test values directly
+        self.conditions: List[Tuple[str, str, Any]] = []
+        self.where = where
+        conditions: List[Predicate] = []
+        for name, value in filters.items():
+            field, op = _parse(name)
+            self.conditions.append((field, op, value))
+            if op == "eq" and not callable(value):
+                self.equalities[field] = value
+            conditions.append(_condition(field, op, value))
+        conditions.extend(where)
+        self.predicate = _combine(conditions)
+
+    def __call__(self, doc: Dict[str, Any]) -> bool:
+        return self.predicate(doc)
+
+
+def _combine(conditions: List[Predicate]) -> Predicate:
+    if not conditions:
+        return lambda doc: True
+    if len(conditions) == 1:
+        return conditions[0]
+
+    def every(doc: Dict[str, Any]) -> bool:
+        for condition in conditions:
+            if not condition(doc):
+                return False
+        return True
+
+    return every
+
+
+def project(
+    docs: Iterable[Dict[str, Any]], fields: Optional[Iterable[str]]
+) -> Iterable[Dict[str, Any]]:
+    """Keep only some fields of each document, if any are given."""
+    if fields is None:
+        return docs
+    keep = tuple(fields)
+    return ({f: doc[f] for f in keep if f in doc} for doc in docs)
@@ -0,0 +1,246 @@
+from __future__ import annotations
+import asyncio
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from concurrent.futures import TimeoutError as FutureTimeout
+from random import uniform
+from time import perf_counter, sleep
+from typing import Collection, Deque, Optional
+
+from httpx import (
+    AsyncBaseTransport,
+    BaseTransport,
+    Request,
+    Response,
+    TransportError,
+)
+
+RETRY_STATUSES = frozenset({429, 500, 502, 503, 504})
+"""The statuses worth retrying, since another attempt may well succeed."""
+
+
+class RetryPolicy:
+    """How requests are retried and hedged. GETs and DELETEs are idempotent, so they are
+    always retried; POSTs only when `retry_posts` is set. Retries wait an exponentially growing,
+    randomly jittered delay, so many clients don't retry in lockstep.
+
+    A hedged GET sends a duplicate when the first attempt hasn't answered within the p95 of
+    recent GETs, and uses whichever answers first. That cuts the slowest requests while
+    only duplicating about one in twenty.
+
+    Args:
+        attempts (int, optional): The most times a request is sent, including the first. Defaults to 3.
+        backoff (float, optional): The longest wait before the first retry, in seconds. It doubles for every retry after it. Defaults to 0.05.
+        max_backoff (float, optional): The longest wait before any retry, in seconds. Defaults to 2.0.
+        retry_posts (bool, optional): Whether to also retry writes. A retried write may be applied twice. Defaults to False.
+        statuses (Collection[int], optional): The response statuses to retry. Defaults to RETRY_STATUSES.
+        hedge (bool, optional): Whether to hedge GETs. Defaults to False.
+        hedge_after (Optional[float], optional): A fixed delay before hedging, in seconds. Defaults to None (the p95 of recent GETs).
+        samples (int, optional): How many recent GET latencies the p95 is taken from. No GET is hedged until 20 have been seen. Defaults to 200.
+    """
+
+    __slots__ = (
+        "attempts",
+        "backoff",
+        "max_backoff",
+        "retry_posts",
+        "statuses",
+        "hedge",
+        "hedge_after",
+        "retries",
+        "hedges",
+        "_latencies",
+    )
+
+    def __init__(
+        self,
+        attempts: int = 3,
+        backoff: float = 0.05,
+        max_backoff: float = 2.0,
+        retry_posts: bool = False,
+        statuses: Collection[int] = RETRY_STATUSES,
+        hedge: bool = False,
+        hedge_after: Optional[float] = None,
+        samples: int = 200,
+    ):
+        self.attempts = max(attempts, 1)
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.retry_posts = retry_posts
+        self.statuses = frozenset(statuses)
+        self.hedge = hedge
+        self.hedge_after = hedge_after
+        self.retries = 0
+        self.hedges = 0
+        self._latencies: Deque[float] = deque(maxlen=samples)
+
+    def retryable(self, request: Request) -> bool:
+        """Whether a request may be sent more than once."""
+        return request.method in ("GET", "HEAD", "DELETE") or self.retry_posts
+
+    def delay(self, attempt: int) -> float:
+        """How long to wait before a retry, with full jitter.
+
+        Args:
+            attempt (int): how many attempts have failed so far.
+
+        Returns:
+            float: the delay, in seconds.
+        """
+        return uniform(0, min(self.max_backoff, self.backoff * 2 ** (attempt - 1)))
+
+    def observe(self, latency: float) -> None:
+        """Record how long a GET took to answer."""
+        self._latencies.append(latency)
+
+    def hedge_delay(self, request: Request) -> Optional[float]:
+        """How long to wait for a request before hedging it.
+
+        Returns:
+            Optional[float]: the delay in seconds, or None if it shouldn't be hedged.
+        """
+        if not self.hedge or request.method != "GET":
+            return None
+        if self.hedge_after is not None:
+            return self.hedge_after
+        if len(self._latencies) < 20:
+            return None
+        latencies = sorted(self._latencies)
+        return latencies[int(len(latencies) * 0.95)]
+
+
+class RetryTransport(BaseTransport):
+    """A transport that retries and hedges the requests it sends through another one.
+
+    Args:
+        transport (BaseTransport): the transport to send requests through.
+        policy (RetryPolicy): how to retry and hedge.
+    """
+
+    def __init__(self, transport: BaseTransport, policy: RetryPolicy):
+        self.transport = transport
+        self.policy = policy
+        self._pool: Optional[ThreadPoolExecutor] = None
+
+    def handle_request(self, request: Request) -> Response:
+        policy = self.policy
+        attempts = policy.attempts if policy.retryable(request) else 1
+        request.read()
+        for attempt in range(1, attempts + 1):
+            try:
+                response = self.__hedged(request)
+            except TransportError:
+                if attempt == attempts:
+                    raise
+            else:
+                if response.status_code not in policy.statuses or attempt == attempts:
+                    return response
+                response.close()
+            policy.retries += 1
+            sleep(policy.delay(attempt))
+        raise AssertionError("unreachable")  # pragma: no cover
+
+    def __timed(self, request: Request) -> Response:
+        start = perf_counter()
+        response = self.transport.handle_request(request)
+        if request.method == "GET":
+            self.policy.observe(perf_counter() - start)
+        return response
+
+    def __hedged(self, request: Request) -> Response:
+        delay = self.policy.hedge_delay(request)
+        if delay is None:
+            return self.__timed(request)
+        if self._pool is None:
+            self._pool = ThreadPoolExecutor(thread_name_prefix="repltable-hedge")
+        first = self._pool.submit(self.__timed, request)
+        try:
+            return first.result(timeout=delay)
+        except FutureTimeout:
+            pass
+        self.policy.hedges += 1
+        second = self._pool.submit(self.__timed, request)
+        done, _ = wait((first, second), return_when=FIRST_COMPLETED)
+        winner = min(done, key=lambda future: future.exception() is not None)
+        other = second if winner is first else first
+        if winner.exception() is not None:
+            # the other attempt may still succeed
+            return other.result()
+        other.add_done_callback(_close)
+        return winner.result()
+
+    def close(self) -> None:
+        if self._pool is not None:
+            self._pool.shutdown(wait=False)
+        self.transport.close()
+
+
+def _close(future: Future) -> None:
+    if future.exception() is None:
+        future.result().close()
+
+
+class AsyncRetryTransport(AsyncBaseTransport):
+    """An async transport that retries and hedges the requests it sends through another one.
+
+    Args:
+        transport (AsyncBaseTransport): the transport to send requests through.
+        policy (RetryPolicy): how to retry and hedge.
+    """
+
+    def __init__(self, transport: AsyncBaseTransport, policy: RetryPolicy):
+        self.transport = transport
+        self.policy = policy
+
+    async def handle_async_request(self, request: Request) -> Response:
+        policy = self.policy
+        attempts = policy.attempts if policy.retryable(request) else 1
+        await request.aread()
+        for attempt in range(1, attempts + 1):
+            try:
+                response = await self.__hedged(request)
+            except TransportError:
+                if attempt == attempts:
+                    raise
+            else:
+                if response.status_code not in policy.statuses or attempt == attempts:
+                    return response
+                await response.aclose()
+            policy.retries += 1
+            await asyncio.sleep(policy.delay(attempt))
+        raise AssertionError("unreachable")  # pragma: no cover
+
+    async def __timed(self, request: Request) -> Response:
+        start = perf_counter()
+        response = await self.transport.handle_async_request(request)
+        if request.method == "GET":
+            self.policy.observe(perf_counter() - start)
+        return response
+
+    async def __hedged(self, request: Request) -> Response:
+        delay = self.policy.hedge_delay(request)
+        if delay is None:
+            return await self.__timed(request)
+        first = asyncio.ensure_future(self.__timed(request))
+        done, _ = await asyncio.wait((first,), timeout=delay)
+        if done:
+            return first.result()
+        self.policy.hedges += 1
+        second = asyncio.ensure_future(self.__timed(request))
+        done, pending = await asyncio.wait(
+            (first, second), return_when=asyncio.FIRST_COMPLETED
+        )
+        winner = min(done, key=lambda task: task.exception() is not None)
+        other = second if winner is first else first
+        if winner.exception() is not None:
+            # the other attempt may still succeed
+            return await other
+        if not other.done():
+            other.cancel()
+        elif other.exception() is None:
+            # both finished, so the loser's response is closed rather than left to hold its connection
+            await other.result().aclose()
+        return winner.result()
+
+    async def aclose(self) -> None:
+        await self.transport.aclose()
@@ -0,0 +1,309 @@
+from __future__ import annotations
+import re
+import zlib
+from base64 import b64decode
+from codecs import getincrementaldecoder
+from collections.abc import MutableSequence
+from json import JSONDecodeError, JSONDecoder
+from threading import Lock
+from typing import (
+    Any,
+    Callable,
+    Dict,
+    Generator,
+    Iterable,
+    Iterator,
+    List,
+    Optional,
+    Tuple,
+)
+from .codec import MARKERS, Codec, loads, zstandard
+from .util import MISSING
+
+_WHITESPACE = re.compile(r"[ \t\n\r]*")
+_decoder = JSONDecoder()
+
+
+class RowStream:
+    """Decodes a stored table incrementally, as its bytes arrive.
+    Rows are parsed and checked one at a time, so the raw value is never held in memory whole.
+    Values that aren't a list of rows, like the manifest of a paged table, are decoded whole at the end.
+
+    Args:
+        codec (Codec): the codec the value was stored with.
+    """
+
+    __slots__ = (
+        "codec",
+        "is_rows",
+        "_text",
+        "_buffer",
+        "_state",
+        "_parts",
+        "_inner",
+        "_unpack",
+        "_packed",
+    )
+
+    def __init__(self, codec: Codec):
+        self.codec = codec
+        self.is_rows = False
+        self._text = getincrementaldecoder("utf-8")()
+        self._buffer = ""
+        # start, then one of: rows, comma (after a row), done, whole or packed
+        self._state = "start"
+        self._parts: List[str] = []
+        self._inner: Optional[RowStream] = None
+        self._unpack: Any = None
+        self._packed = ""
+
+    def feed(self, chunk: bytes) -> List[Dict[str, Any]]:
+        """Decode the next bytes of the value.
+
+        Args:
+            chunk (bytes): the next bytes.
+
+        Raises:
+            ValueError: if the value is a list with something other than rows in it.
+
+        Returns:
+            List[Dict[str, Any]]: the rows that were completed by these bytes.
+        """
+        return self.__feed(self._text.decode(chunk))
+
+    def close(self) -> Tuple[List[Dict[str, Any]], Any]:
+        """Finish decoding the value.
+
+        Raises:
+            ValueError: if the list of rows was cut short.
+
+        Returns:
+            Tuple[List[Dict[str, Any]], Any]: the last rows, and the whole value if it wasn't a list of rows, otherwise MISSING.
+        """
+        rows = self.__feed(self._text.decode(b"", True))
+        if self._state == "packed":
+            rows += self.__unpack("", final=True)
+            tail, value = self._inner.close()  # type: ignore
+            self.is_rows = self._inner.is_rows  # type: ignore
+            return rows + tail, value
+        if self._state in ("whole", "start"):
+            return rows, self.codec.decode("".join(self._parts) + self._buffer)
+        if self._state != "done":
+            raise ValueError("The table's value was cut short.")
+        return rows, MISSING
+
+    def __feed(self, text: str) -> List[Dict[str, Any]]:
+        if self._state == "whole":
+            self._parts.append(text)
+            return []
+        if self._state == "packed":
+            return self.__unpack(text)
+        self._buffer += text
+        if self._state == "start":
+            start = _WHITESPACE.match(self._buffer).end()  # type: ignore
+            head = self._buffer[start:]
+            if not head:
+                return []
+            if head[0] == "[":
+                self._state, self.is_rows = "rows", True
+                self._buffer = head[1:]
+                return self.__rows()
+            elif head.startswith("repltable:") or "repltable:".startswith(head):
+                for compression, marker in MARKERS.items():
+                    if head.startswith(marker):
+                        self.__start_unpacking(compression)
+                        self._buffer = ""
+                        return self.__unpack(head[len(marker) :])
+                if len(head) < max(map(len, MARKERS.values())):
+                    # wait for the whole marker
+                    return []
+            # anything else is decoded whole once it has all arrived
+            self._state = "whole"
+            self._parts.append(self._buffer)
+            self._buffer = ""
+            return []
+        return self.__rows()
+
+    def __start_unpacking(self, compression: str) -> None:
+        self._state = "packed"
+        self._inner = RowStream(self.codec)
+        if compression == "zlib":
+            self._unpack = zlib.decompressobj()
+        elif zstandard is None:
+            raise ValueError("Decoding zstd values needs the `zstandard` package.")
+        else:
+            self._unpack = zstandard.ZstdDecompressor().decompressobj()
+
+    def __unpack(self, text: str, final: bool = False) -> List[Dict[str, Any]]:
+        # base64 decodes in whole groups of four characters
+        self._packed += text
+        usable = len(self._packed) if final else len(self._packed) // 4 * 4
+        packed, self._packed = self._packed[:usable], self._packed[usable:]
+        raw = self._unpack.decompress(b64decode(packed)) if packed else b""
+        if final:
+            raw += self._unpack.flush()
+        return self._inner.feed(raw) if raw else []  # type: ignore
+
+    def __rows(self) -> List[Dict[str, Any]]:
+        rows: List[Dict[str, Any]] = []
+        buffer, position = self._buffer, 0
+        if self._state in ("rows", "row"):
+            # parse every whole row at once, up to the last `},` that isn't inside a string
+            cut = buffer.rfind("},")
+            if cut > 0:
+                try:
+                    batch = loads(f"[{buffer[: cut + 1]}]")
+                except ValueError:
+                    batch = None
+                if batch is not None and all(type(row) is dict for row in batch):
+                    rows, position, self._state = batch, cut + 2, "row"
+        while self._state != "done":
+            position = _WHITESPACE.match(buffer, position).end()  # type: ignore
+            if position == len(buffer):
+                break
+            char = buffer[position]
+            if self._state == "comma":
+                if char == ",":
+                    self._state = "row"
+                elif char == "]":
+                    self._state = "done"
+                else:
+                    raise ValueError("The table's value isn't valid JSON.")
+                position += 1
+                continue
+            if char == "]" and self._state == "rows":
+                # an empty table
+                self._state = "done"
+                position += 1
+                continue
+            if char != "{":
+                raise ValueError("The table has a row that isn't a dict.")
+            try:
+                row, position = _decoder.raw_decode(buffer, position)
+            except JSONDecodeError:
+                # the row isn't all here yet
+                break
+            rows.append(row)
+            self._state = "comma"
+        self._buffer = buffer[position:]
+        if self._state == "done" and self._buffer.strip():
+            raise ValueError("The table's value isn't valid JSON.")
+        return rows
+
+
+class LazyRows(MutableSequence):
+    """The rows of a table that may still be downloading. Iterating over them reads rows
+    as they arrive; anything that needs every row, like len() or a change, reads the rest first.
+    The download stays open until every row has been read.
+
+    Args:
+        source (Iterator[Dict[str, Any]]): the rows, as they are decoded.
+        done (Optional[Callable[[List[Dict[str, Any]]], None]], optional): Called with every row once they have all arrived. Defaults to None.
+    """
+
+    __slots__ = ("_rows", "_source", "_done", "_lock")
+
+    def __init__(
+        self,
+        source: Iterator[Dict[str, Any]],
+        done: Optional[Callable[[List[Dict[str, Any]]], None]] = None,
+    ):
+        self._rows: List[Dict[str, Any]] = []
+        self._source: Optional[Iterator[Dict[str, Any]]] = source
+        self._done = done
+        self._lock = Lock()
+
+    @property
+    def complete(self) -> bool:
+        """Whether every row has arrived."""
+        return self._source is None
+
+    def __pull(self) -> bool:
+        with self._lock:
+            if self._source is None:
+                return False
+            row = next(self._source, MISSING)
+            if row is MISSING:
+                self.__finish()
+                return False
+            self._rows.append(row)  # type: ignore
+            return True
+
+    def __finish(self) -> None:
+        self._source = None
+        if self._done is not None:
+            self._done(self._rows)
+
+    def rows(self) -> List[Dict[str, Any]]:
+        """Read every row, and get them as the underlying list."""
+        with self._lock:
+            if self._source is not None:
+                self._rows.extend(self._source)
+                self.__finish()
+        return self._rows
+
+    def __iter__(self) -> Iterator[Dict[str, Any]]:
+        position = 0
+        while position < len(self._rows) or self.__pull():
+            yield self._rows[position]
+            position += 1
+
+    def __len__(self) -> int:
+        return len(self.rows())
+
+    def __getitem__(self, position):  # type: ignore[override]
+        if isinstance(position, int) and position >= 0:
+            while position >= len(self._rows) and self.__pull():
+                pass
+            return self._rows[position]
+        return self.rows()[position]
+
+    def __setitem__(self, position, row) -> None:  # type: ignore[override]
+        self.rows()[position] = row
+
+    def __delitem__(self, position) -> None:  # type: ignore[override]
+        del self.rows()[position]
+
+    def insert(self, position: int, row: Dict[str, Any]) -> None:
+        self.rows().insert(position, row)
+
+    def append(self, row: Dict[str, Any]) -> None:
+        self.rows().append(row)
+
+    def copy(self) -> List[Dict[str, Any]]:
+        return self.rows().copy()
+
+    def __eq__(self, other: object) -> bool:
+        if isinstance(other, LazyRows):
+            other = other.rows()
+        return self.rows() == other
+
+    def __repr__(self) -> str:
+        state = "" if self.complete else ", downloading"
+        return f"LazyRows({len(self._rows)} rows{state})"
+
+
+def valid_rows(rows: Iterable[Any], table: str) -> Iterator[Dict[str, Any]]:
+    """Check rows that were already decoded as they are iterated over.
+
+    Raises:
+        ValueError: if one of them isn't a dict.
+    """
+    for row in rows:
+        if not isinstance(row, dict):
+            raise ValueError(f"`{table}` is not a valid table.")
+        yield row
+
+
+def collect(source: Generator[Any, None, Any]) -> Tuple[List[Any], Any]:
+    """Read everything a generator yields, and what it returns.
+
+    Returns:
+        Tuple[List[Any], Any]: what it yielded, and its return value.
+    """
+    result: List[Any] = []
+
+    def capture() -> Generator[Any, None, None]:
+        result.append((yield from source))
+
+    return list(capture()), result[0]
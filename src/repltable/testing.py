@@ -0,0 +1,145 @@
+from __future__ import annotations
+from ast import literal_eval
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from json import dumps, loads
+from threading import Lock, Thread
+from time import sleep
+from typing import Dict, Optional
+from urllib.parse import parse_qs, unquote, urlsplit
+
+
+class StandInServer:
+    """A local, in-memory stand-in for the Replit Database, for tests and benchmarks.
+    It speaks the same key/value protocol the clients use, and can simulate a slow network.
+
+    Args:
+        latency (float, optional): Seconds to wait before answering each request. Defaults to 0.
+        bandwidth (Optional[int], optional): Bytes per second to send response bodies at. Defaults to None (unlimited).
+        host (str, optional): The address to listen on. Defaults to "127.0.0.1".
+        port (int, optional): The port to listen on. Defaults to 0 (any free port).
+    """
+
+    __slots__ = (
+        "latency",
+        "bandwidth",
+        "store",
+        "requests",
+        "_lock",
+        "_server",
+        "_thread",
+    )
+
+    def __init__(
+        self,
+        latency: float = 0,
+        bandwidth: Optional[int] = None,
+        host: str = "127.0.0.1",
+        port: int = 0,
+    ):
+        self.latency = latency
+        self.bandwidth = bandwidth
+        self.store: Dict[str, str] = {}
+        self.requests = 0
+        self._lock = Lock()
+        self._server = ThreadingHTTPServer((host, port), _handler(self))
+        self._server.daemon_threads = True
+        self._thread: Optional[Thread] = None
+
+    @property
+    def url(self) -> str:
+        """The db_url to pass to a Database."""
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self) -> StandInServer:
+        """Start serving in a background thread."""
+        self._thread = Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        """Stop serving."""
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self) -> StandInServer:
+        return self.start()
+
+    def __exit__(self, *exc) -> None:
+        self.stop()
+
+    def prefix(self, prefix: str) -> str:
+        with self._lock:
+            return "\n".join(k for k in sorted(self.store) if k.startswith(prefix))
+
+    def update(self, data: Dict[str, str]) -> None:
+        with self._lock:
+            self.store.update(data)
+
+    def delete(self, key: str) -> None:
+        with self._lock:
+            self.store.pop(key, None)
+
+
+def _handler(server: StandInServer) -> type:
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+        disable_nagle_algorithm = True
+
+        def log_message(self, format: str, *args) -> None:
+            pass
+
+        def _respond(self, status: int, body: bytes = b"") -> None:
+            with server._lock:
+                server.requests += 1
+            if server.latency:
+                sleep(server.latency)
+            self.send_response(status)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            if not server.bandwidth:
+                self.wfile.write(body)
+                return
+            chunk = max(server.bandwidth // 100, 1)
+            for start in range(0, len(body), chunk):
+                self.wfile.write(body[start : start + chunk])
+                sleep(chunk / server.bandwidth)
+
+        def _key(self) -> str:
+            return unquote(urlsplit(self.path).path.lstrip("/"))
+
+        def do_GET(self) -> None:
+            query = parse_qs(urlsplit(self.path).query, keep_blank_values=True)
+            if "prefix" in query:
+                return self._respond(200, server.prefix(query["prefix"][0]).encode())
+            value = server.store.get(self._key())
+            if value is None:
+                return self._respond(404)
+            self._respond(200, value.encode())
+
+        def do_POST(self) -> None:
+            body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+            if "json" in self.headers.get("Content-Type", ""):
+                data = loads(body)
+                if isinstance(data, str):
+                    # older versions of repltable send the repr of a dict as a JSON string
+                    data = literal_eval(data)
+                server.update(
+                    {k: v if isinstance(v, str) else dumps(v) for k, v in data.items()}
+                )
+            else:
+                server.update(
+                    {
+                        k: v[0]
+                        for k, v in parse_qs(
+                            body.decode(), keep_blank_values=True
+                        ).items()
+                    }
+                )
+            self._respond(200)
+
+        def do_DELETE(self) -> None:
+            server.delete(self._key())
+            self._respond(200)
+
+    return Handler
@@ -0,0 +1,78 @@
+from __future__ import annotations
+from threading import Lock
+from typing import Dict, Optional
+
+from httpx import AsyncHTTPTransport, HTTPTransport, Limits, Timeout
+
+DEFAULT_LIMITS = Limits(max_connections=100, max_keepalive_connections=20)
+"""The same pool limits an httpx client uses by default."""
+
+DEFAULT_TIMEOUT = Timeout(5.0)
+"""The same timeout an httpx client uses by default."""
+
+_transports: Dict[str, HTTPTransport] = {}
+_async_transports: Dict[str, AsyncHTTPTransport] = {}
+_lock = Lock()
+
+
+def shared_transport(
+    db_url: str, limits: Optional[Limits] = None, http2: bool = False
+) -> HTTPTransport:
+    """Get the process-wide transport (and so connection pool) for a database URL,
+    creating it the first time. Later calls reuse the warm connections, whatever settings they pass.
+
+    Args:
+        db_url (str): the database URL.
+        limits (Optional[Limits], optional): The pool limits to create the transport with. Defaults to DEFAULT_LIMITS.
+        http2 (bool, optional): Whether to multiplex requests over HTTP/2. Needs `httpx[http2]`. Defaults to False.
+
+    Returns:
+        HTTPTransport: the shared transport.
+    """
+    with _lock:
+        transport = _transports.get(db_url)
+        if transport is None:
+            transport = _transports[db_url] = HTTPTransport(
+                limits=limits or DEFAULT_LIMITS, http2=http2
+            )
+        return transport
+
+
+def shared_async_transport(
+    db_url: str, limits: Optional[Limits] = None, http2: bool = False
+) -> AsyncHTTPTransport:
+    """Get the process-wide async transport for a database URL, creating it the first time.
+    Async connections belong to the event loop they were opened on, so only share it within one loop.
+
+    Args:
+        db_url (str): the database URL.
+        limits (Optional[Limits], optional): The pool limits to create the transport with. Defaults to DEFAULT_LIMITS.
+        http2 (bool, optional): Whether to multiplex requests over HTTP/2. Needs `httpx[http2]`. Defaults to False.
+
+    Returns:
+        AsyncHTTPTransport: the shared transport.
+    """
+    with _lock:
+        transport = _async_transports.get(db_url)
+        if transport is None:
+            transport = _async_transports[db_url] = AsyncHTTPTransport(
+                limits=limits or DEFAULT_LIMITS, http2=http2
+            )
+        return transport
+
+
+def close_shared_transports() -> None:
+    """Close every shared sync transport. Databases using them can't make requests afterwards."""
+    with _lock:
+        for transport in _transports.values():
+            transport.close()
+        _transports.clear()
+
+
+async def aclose_shared_transports() -> None:
+    """Close every shared async transport. Databases using them can't make requests afterwards."""
+    with _lock:
+        transports = list(_async_transports.values())
+        _async_transports.clear()
+    for transport in transports:
+        await transport.aclose()
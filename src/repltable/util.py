@@ -1,5 +1,11 @@
 from typing import List
 
+MISSING = object()
+"""Sentinel for cache lookups, since None is a valid cached value."""
+
+INTERNAL = "__repltable_"
+"""Prefix of the keys repltable keeps its own bookkeeping in, which keys() and prefix() leave out."""
+
 
 def remove_duplicates(data: list):
     if not data:
@@ -1,7 +1,29 @@
-from repltable import Database, Table  # type: ignore
+from repltable import (  # type: ignore
+    Database,
+    Table,
+    LRUCache,
+    DiskCache,
+    RawCache,
+    WriteBuffer,
+    Metrics,
+    KeyIndex,
+    Codec,
+    Query,
+    ColumnarRows,
+    RetryPolicy,
+    Coherence,
+    Prefetcher,
+    LazyRows,
+)
+from repltable.testing import StandInServer  # type: ignore
+from repltable.cache import approximate_size  # type: ignore
+from repltable.codec import orjson  # type: ignore
 from dotenv import load_dotenv
 from os import environ
 import pytest
+from time import perf_counter, sleep
+import httpx
+from concurrent.futures import ThreadPoolExecutor
 
 load_dotenv(".env.local")
 
@@ -88,3 +110,692 @@ def test_delete():
 def drop_table_from_db():
     db.delete("things")
     assert getattr(db, "things", None) is None
+
+
+def test_lru_cache():
+    cache = LRUCache(max_entries=2)
+    cached_db = Database(db_url=environ["REPLIT_DB_URL"], cache=cache)
+    cached_db.set_bulk({"test": "item", "test2": "item2", "test3": "item3"})
+    assert "test" not in cache and cache.evictions == 1
+    assert cached_db.get("test3") == "item3"
+    assert cached_db.get("test") == "item"
+    assert cache.hits == 1 and cache.misses == 1
+    cache.set("test2", "item2", ttl=0)
+    assert "test2" not in cache
+    # dropping keys isn't a lookup
+    assert cache.pop("test") == "item" and cache.pop("test", None) is None
+    assert cache.hits == 1 and cache.misses == 1
+    for key in ("test", "test2", "test3"):
+        cached_db.delete(key)
+    assert cached_db.get("test") is None
+
+
+def test_populate_cache():
+    db.set_bulk({"warm:a": "1", "warm:b": "2", "cold": "3"})
+    fresh = Database(db_url=environ["REPLIT_DB_URL"])
+    seen = []
+    fresh.populate_cache(
+        prefix="warm:", concurrency=4, progress=lambda d, t: seen.append((d, t))
+    )
+    assert set(fresh._cache) == {"warm:a", "warm:b"}
+    assert seen[-1] == (2, 2)
+    for key in ("warm:a", "warm:b", "cold"):
+        db.delete(key)
+
+
+def test_raw_cache():
+    rows = [{"id": i, "name": f"user {i}"} for i in range(100)]
+    with StandInServer() as server:
+        for i in range(20):
+            server.store[f"raw:{i}"] = Codec().encode(rows)
+        cache = RawCache(decoded_bytes=50_000)
+        local = Database(db_url=server.url, cache=cache)
+        local.populate_cache(prefix="raw:")
+        # populating stores the responses without decoding them
+        assert len(cache) == 20 and cache.decodes == 0 and cache.decoded_size == 0
+        assert cache.raw_size < sum(map(approximate_size, [rows] * 20)) // 4
+        assert local.get("raw:1") == local.get("raw:1") == rows
+        assert cache.decodes == 1 and server.requests == 21
+        local.set("local", rows)
+        # the cache keeps the bytes that were written, rather than encoding them again
+        assert cache._raw["local"] == server.store["local"].encode()
+        for i in range(20):
+            local.get(f"raw:{i}")
+        # the decoded tier stays within its budget
+        assert cache.decoded_size <= 50_000 and "local" in cache._raw
+        assert local.get("local") == rows
+        stats = cache.stats()
+        assert stats["bytes"] == stats["raw_bytes"] + stats["decoded_bytes"]
+        local.delete("raw:1")
+        assert "raw:1" not in cache and local.get("raw:1") is None
+        local.close()
+
+        # without a decoded budget, values are never measured
+        def sizeof(value):
+            raise AssertionError("measured a value")
+
+        cache = RawCache(decoded_bytes=None, sizeof=sizeof)
+        local = Database(db_url=server.url, cache=cache)
+        local.set("local", rows)
+        assert local.get("raw:2") == rows and local.get("local") == rows
+        assert cache.decoded_size == 0
+        local.close()
+
+        # values over the decoded budget are written without being encoded a second time
+        class Counting(Codec):
+            __slots__ = ("encodes",)
+
+            def encode(self, value):
+                self.encodes += 1
+                return super().encode(value)
+
+        codec = Counting()
+        codec.encodes = 0
+        cache = RawCache(decoded_bytes=10_000)
+        local = Database(db_url=server.url, cache=cache, codec=codec)
+        local.set("large", rows)
+        assert codec.encodes == 1 and "large" in cache._raw
+        table = local.get_table("encoded")
+        for i in range(100):
+            table.insert(dict(id=i, name=f"user {i}"))
+        # each write sends the table and its catalog entry
+        assert codec.encodes == 1 + 2 * 101
+        local.close()
+
+
+def test_get_many():
+    db.set_bulk({"many:a": "one", "many:b": {"x": 1}})
+    fresh = Database(db_url=environ["REPLIT_DB_URL"])
+    fresh.get("many:a")
+    assert fresh.get_many(["many:a", "many:b", "many:missing"]) == {
+        "many:a": "one",
+        "many:b": {"x": 1},
+        "many:missing": None,
+    }
+    db.delete("many:a")
+    db.delete("many:b")
+
+
+def test_write_behind():
+    buffered = Database(
+        db_url=environ["REPLIT_DB_URL"], write_behind=WriteBuffer(interval=60)
+    )
+    table = buffered.get_table("buffered")
+    for i in range(5):
+        table.insert(dict(id=i))
+    buffered.set("test", "item")
+    buffered.set("test", "item2")
+    buffered.delete("test")
+    assert buffered.get("test") is None
+    assert db.get("buffered") is None
+    db.set("stale", "old")
+    buffered.delete("stale")
+    buffered.set("other", "item")
+    assert buffered.get_many(["stale", "other"]) == {"stale": None, "other": "item"}
+    buffered.flush()
+    assert Database(db_url=environ["REPLIT_DB_URL"]).get("buffered") == [
+        dict(id=i) for i in range(5)
+    ]
+    buffered.delete_many(["buffered", "other"])
+    buffered.close()
+    assert Database(db_url=environ["REPLIT_DB_URL"]).get("buffered") is None
+
+    # a flushing delete stays visible until the database has applied it
+    store = {"k": '"old"'}
+
+    def slow_deletes(request):
+        key = request.url.path[1:]
+        if request.method == "DELETE":
+            sleep(0.3)
+            store.pop(key, None)
+            return httpx.Response(200)
+        if key in store:
+            return httpx.Response(200, text=store[key])
+        return httpx.Response(404)
+
+    local = Database(
+        db_url="http://kv",
+        transport=httpx.MockTransport(slow_deletes),
+        write_behind=WriteBuffer(interval=60),
+    )
+    local.delete("k")
+    with ThreadPoolExecutor(max_workers=1) as pool:
+        flushing = pool.submit(local.flush)
+        sleep(0.1)
+        assert local.get("k") is None
+        flushing.result()
+    assert local.get("k") is None and "k" not in local._cache
+    local.close()
+
+
+def test_index():
+    table = db.get_table("indexed")
+    table.insert(dict(id=1, role="admin"))
+    table.insert(dict(id=2, role="member"))
+    table.create_index("id")
+    table.create_index("role")
+    table.insert(dict(id=3, role="admin"))
+    assert [doc["id"] for doc in table.get(role="admin")] == [1, 3]
+    table.update(dict(id=2, role="admin"), id=2)
+    assert [doc["id"] for doc in table.get(role="admin")] == [1, 2, 3]
+    table.delete(id=1)
+    assert table.get_one(id=1) is None
+    assert table.get_one(id=3, role="admin") == dict(id=3, role="admin")
+    assert table.get(id=3, role="member") == []
+    db.delete("indexed")
+
+
+def test_sorted_index():
+    table = db.get_table("sorted")
+    for created_at in (30, 10, 20):
+        table.insert(dict(id=created_at // 10, created_at=created_at))
+    table.create_sorted_index("created_at")
+    table.insert(dict(id=4, created_at=40))
+    table.insert(dict(id=5))
+    assert [doc["id"] for doc in table.ordered("created_at")] == [1, 2, 3, 4]
+    assert [doc["id"] for doc in table.ordered("created_at", low=15, high=35)] == [2, 3]
+    assert [doc["id"] for doc in table.get(created_at__gte=30)] == [3, 4]
+    table.update(dict(id=2, created_at=50), id=2)
+    assert [doc["id"] for doc in table.top_k("created_at", 2)] == [2, 4]
+    table.delete(created_at__lt=20)
+    assert table.first("created_at")["id"] == 3 and table.last("created_at")["id"] == 2
+    assert table.get_one(created_at=40) == dict(id=4, created_at=40)
+    db.delete("sorted")
+
+    # values that can't be compared make the index incomplete until they're gone
+    mixed = db.get_table("mixed")
+    mixed.insert(dict(id=1, created_at="pending"))
+    mixed.insert(dict(id=2, created_at=20))
+    mixed.create_sorted_index("created_at")
+    assert mixed.get(created_at=20) == [dict(id=2, created_at=20)]
+    with pytest.raises(TypeError):
+        mixed.last("created_at")
+    mixed.update(dict(id=1, created_at=None), id=1)
+    assert mixed.get(created_at=20) == [dict(id=2, created_at=20)]
+    assert mixed.get(created_at__gte=10) == [dict(id=2, created_at=20)]
+    assert mixed.last("created_at")["id"] == 2
+    db.delete("mixed")
+
+
+def test_paged_table():
+    db.set("legacy", [dict(id=i) for i in range(5)])
+    table = db.get_table("legacy", page_size=2)
+    assert db.get("legacy:page:2") == [dict(id=4)]
+    table.insert(dict(id=5))
+    table.delete(id=0)
+    fresh = Database(db_url=environ["REPLIT_DB_URL"])
+    reloaded = fresh.get_table("legacy")
+    assert reloaded.page_size == 2
+    assert reloaded.data == [dict(id=i) for i in range(1, 6)]
+    fresh.drop_table("legacy")
+    assert db.prefix("legacy") == []
+
+
+def test_batch():
+    table = db.get_table("batched")
+    with table.batch():
+        for i in range(10):
+            table.insert(dict(id=i))
+        assert Database(db_url=environ["REPLIT_DB_URL"]).get("batched") == []
+    assert len(Database(db_url=environ["REPLIT_DB_URL"]).get("batched")) == 10
+    with pytest.raises(RuntimeError):
+        with table.batch():
+            table.insert(dict(id=10))
+            table.delete(id=0)
+            raise RuntimeError
+    assert table.data == [dict(id=i) for i in range(10)]
+    assert db.get("batched") == table.data
+    db.delete("batched")
+
+
+def test_iter_keys():
+    db.set_bulk({"iter:a": "one", "iter:b": "two", "other": "three"})
+    assert list(db.iter_keys("iter:")) == ["iter:a", "iter:b"]
+    assert dict(
+        Database(db_url=environ["REPLIT_DB_URL"]).iter_items("iter:", concurrency=1)
+    ) == {
+        "iter:a": "one",
+        "iter:b": "two",
+    }
+    for key in ("iter:a", "iter:b", "other"):
+        db.delete(key)
+
+
+def test_stand_in_server():
+    with StandInServer(latency=0.05) as server:
+        local = Database(db_url=server.url)
+        start = perf_counter()
+        local.set("test", {"nested": [1, 2]})
+        assert perf_counter() - start >= 0.05
+        assert Database(db_url=server.url).get("test") == {"nested": [1, 2]}
+        assert local.keys() == ["test"]
+        local.delete("test")
+        assert server.store == {} and server.requests == 4
+        local.close()
+
+
+def test_metrics():
+    events = []
+    metrics = Metrics(exporters=[events.append])
+    with StandInServer() as server:
+        measured = Database(db_url=server.url, metrics=metrics)
+        measured.set("test", "item")
+        assert measured.get("test") == "item"
+        assert measured.get("test2") is None
+        table = measured.get_table("measured")
+        table.insert(dict(id=1))
+        measured.delete("measured")
+        measured.delete("test")
+        measured.close()
+    snapshot = metrics.snapshot()
+    # a table's catalog entry is written along with each of its mutations
+    assert snapshot["latency"]["set_bulk"]["count"] == 3
+    assert snapshot["latency"]["get"]["count"] == 2
+    assert "prefix" not in snapshot["latency"]
+    assert snapshot["statuses"] == {200: 5, 404: 2}
+    assert snapshot["hits"] == 1 and snapshot["misses"] == 2
+    assert snapshot["mutations"] == 2 and snapshot["rows_written"] == 1
+    assert snapshot["sent"] > 0
+    assert {event["type"] for event in events} == {"request", "cache", "mutation"}
+
+
+def test_shared_transport():
+    first = Database(db_url=environ["REPLIT_DB_URL"], shared=True)
+    second = Database(db_url=environ["REPLIT_DB_URL"], shared=True, timeout=1)
+    assert first.http._transport is second.http._transport
+    first.set("test", "item")
+    first.close()
+    assert second.get("test") == "item"
+    second.delete("test")
+    second.close()
+
+
+def test_disk_cache(tmp_path):
+    path = str(tmp_path / "cache.db")
+    persisted = Database(db_url=environ["REPLIT_DB_URL"], cache=DiskCache(path))
+    persisted.set_bulk({"test": {"a": [1, 2]}, "test2": "item2"})
+    persisted.close()
+    db.delete("test2")
+    restarted = Database(db_url=environ["REPLIT_DB_URL"], cache=DiskCache(path))
+    assert "test2" in restarted._cache
+    assert restarted.validate_cache() == 1
+    assert "test2" not in restarted._cache
+    db.set("test", "changed")
+    assert restarted.get("test") == {"a": [1, 2]}
+    assert (
+        Database(db_url=environ["REPLIT_DB_URL"], cache=DiskCache(path, max_age=0)).get(
+            "test"
+        )
+        == "changed"
+    )
+    restarted.delete("test")
+
+
+def test_key_index():
+    db.set_bulk({"idx:a": "one", "idx:b": "two"})
+    metrics = Metrics()
+    indexed = Database(
+        db_url=environ["REPLIT_DB_URL"], key_index=KeyIndex(), metrics=metrics
+    )
+    assert indexed.prefix("idx:") == ["idx:a", "idx:b"]
+    indexed.set("idx:c", "three")
+    indexed.delete("idx:a")
+    assert indexed.prefix("idx:") == ["idx:b", "idx:c"]
+    indexed.get_table("idx_table")
+    assert "idx_table" in indexed.keys()
+    assert metrics.snapshot()["latency"]["prefix"]["count"] == 1
+    db.set("idx:d", "four")
+    assert "idx:d" not in indexed.prefix("idx:")
+    indexed.refresh_keys()
+    assert indexed.prefix("idx:") == ["idx:b", "idx:c", "idx:d"]
+    for key in ("idx:b", "idx:c", "idx:d", "idx_table"):
+        indexed.delete(key)
+
+
+def test_codec():
+    codec = Codec(compression="zlib", compress_over=64)
+    value = [dict(name="test", value=i) for i in range(100)]
+    encoded = codec.encode(value)
+    assert encoded.startswith("repltable:zlib:") and len(encoded) < len(
+        Codec().encode(value)
+    )
+    assert codec.decode(encoded) == value
+    assert codec.decode('{"plain": true}') == {"plain": True}
+    assert codec.decode("not json") == "not json"
+    # values orjson can't write or read exactly still round-trip
+    wide = {
+        "n": 2**70,
+        "low": -(2**63) - 1,
+        "high": 2**64 - 1,
+        "nan": float("nan"),
+        "rows": [{"inf": float("inf")}],
+        "none": None,
+    }
+    decoded = codec.decode(codec.encode(wide))
+    assert decoded["n"] == 2**70 and decoded["low"] == -(2**63) - 1
+    assert decoded["high"] == 2**64 - 1 and decoded["rows"] == [{"inf": float("inf")}]
+    assert decoded["nan"] != decoded["nan"] and decoded["none"] is None
+    assert Codec().decode("-9223372036854775809") == -(2**63) - 1
+    if orjson is not None:
+        # None alone is left to orjson, rather than encoded a second time
+        with pytest.MonkeyPatch.context() as patch:
+            patch.setattr("repltable.codec.json", None)
+            assert Codec().dumps({"none": None, "text": "null"}) == (
+                b'{"none":null,"text":"null"}'
+            )
+    compressed = Database(db_url=environ["REPLIT_DB_URL"], codec=codec)
+    compressed.set("test", value)
+    assert Database(db_url=environ["REPLIT_DB_URL"]).get("test") == value
+    compressed.set("test", "1")
+    assert Database(db_url=environ["REPLIT_DB_URL"]).get("test") == "1"
+    compressed.delete("test")
+
+
+def test_query():
+    table = db.get_table("queried")
+    with table.batch():
+        for i in range(10):
+            table.insert(
+                dict(id=i, score=i * 10, tags=["even" if i % 2 == 0 else "odd"])
+            )
+        table.insert(dict(id=10, name="named"))
+    assert [doc["id"] for doc in table.find(score__gte=50, score__lt=80)] == [5, 6, 7]
+    assert [doc["id"] for doc in table.find(id__in=[1, 3, 99])] == [1, 3]
+    assert [
+        doc["id"] for doc in table.find(tags__contains="odd", limit=2, offset=1)
+    ] == [3, 5]
+    assert table.find(name__exists=True, fields=["name"]) == [dict(name="named")]
+    assert table.find(score__between=(0, 10), fields=["id"]) == [dict(id=0), dict(id=1)]
+    assert table.find(lambda doc: doc["id"] > 8) == [table.data[9], table.data[10]]
+    assert table.get_one(score=lambda score: score > 85)["id"] == 9
+    assert table.get(score__gt="text") == []
+    seen = []
+    assert table.get_one(lambda doc: seen.append(doc) or True)["id"] == 0
+    assert len(seen) == 1
+    table.create_index("id")
+    query = Query(id=4, score__gt=0)
+    assert table.find(query) == [table.data[4]]
+    table.delete(id__gte=5)
+    assert len(table.data) == 5
+    db.delete("queried")
+
+
+def test_columnar_table():
+    rows = [dict(id=i, name=f"row{i}", score=i / 2) for i in range(6)]
+    db.set("columnar", rows)
+    table = db.get_table("columnar", columnar=True)
+    assert isinstance(table.data, ColumnarRows)
+    assert table.get() == rows
+    table.insert(dict(id=6, name="row6", extra=True))
+    table.update(dict(id=1, name="renamed", score=0.5), id=1)
+    table.delete(id__gte=4, extra__exists=False)
+    assert table.find(name__startswith="row", fields=["id"]) == [
+        dict(id=0),
+        dict(id=2),
+        dict(id=3),
+        dict(id=6),
+    ]
+    assert table.get_one(name="renamed") == dict(id=1, name="renamed", score=0.5)
+    reloaded = Database(db_url=environ["REPLIT_DB_URL"]).get_table("columnar")
+    assert reloaded.data == table.get()
+    # other readers of the key still get a plain list
+    assert type(db.get("columnar")) is list and db.get("columnar") == table.get()
+    assert db.get_many(["columnar"])["columnar"] == table.get()
+    db.get_table("columnar_paged", page_size=2).insert(dict(id=1))
+    fresh = Database(db_url=environ["REPLIT_DB_URL"])
+    fresh.get_table("columnar_paged", columnar=True)
+    assert fresh.get("columnar_paged:page:0") == [dict(id=1)]
+    assert type(fresh.get("columnar_paged:page:0")) is list
+    db.drop_table("columnar_paged")
+    db.drop_table("columnar")
+
+
+def test_list_tables():
+    with StandInServer() as server:
+        server.store["legacy"] = '[{"id": 1}]'
+        server.store["note"] = '"not a table"'
+        local = Database(db_url=server.url)
+        # tables written before the catalog existed are only listed once discovered
+        assert local.list_tables() == []
+        assert local.discover_tables() == ["legacy"]
+        assert local.list_tables() == ["legacy"]
+        table = local.get_table("people", page_size=2)
+        table.insert(dict(id=1, name="a"))
+        table.insert(dict(id=2, name="b", age=3))
+        fresh = Database(db_url=server.url)
+        before = server.requests
+        assert sorted(fresh.list_tables()) == ["legacy", "people"]
+        assert fresh.catalog()["people"] == {
+            "rows": 2,
+            "layout": "paged",
+            "page_size": 2,
+            "fields": ["age", "id", "name"],
+        }
+        fresh.get_table("people")
+        # a listing each, one read per entry, and the manifest and page
+        assert server.requests - before == 6
+        fresh.drop_table("legacy")
+        assert Database(db_url=server.url).list_tables() == ["people"]
+        # tables created by different databases don't overwrite each other's entries
+        local.get_table("a_table").insert(dict(id=1))
+        fresh.get_table("b_table").insert(dict(id=1))
+        assert local.list_tables() == ["a_table", "b_table", "people"]
+        # a table deleted with delete() stays listed until drop_table is called for it
+        local.delete("people")
+        assert fresh.list_tables() == ["a_table", "b_table", "people"]
+        fresh.drop_table("people")
+        before = server.requests
+        assert fresh.list_tables() == ["a_table", "b_table"]
+        assert server.requests - before == 1
+        assert "a_table" in local.keys() and not local.prefix("__repltable_")
+        local.close()
+        fresh.close()
+    with StandInServer() as server:
+        for i in range(50):
+            server.store[f"key:{i}"] = f'"{i}"'
+        local = Database(db_url=server.url)
+        # loading a table doesn't read the rest of the database
+        local.get_table("people")
+        assert server.requests == 2
+        assert not any(key.startswith("key:") for key in local._cache)
+        local.close()
+
+
+def test_retry():
+    calls = []
+
+    def flaky(request):
+        calls.append(request.method)
+        if len(calls) % 3:
+            return httpx.Response(503)
+        return httpx.Response(200, text='"item"')
+
+    policy = RetryPolicy(attempts=3, backoff=0.001)
+    local = Database(
+        db_url="http://kv", transport=httpx.MockTransport(flaky), retry=policy
+    )
+    assert local.get("test") == "item"
+    assert calls == ["GET"] * 3 and policy.retries == 2
+    # writes aren't retried unless asked to
+    with pytest.raises(httpx.HTTPStatusError):
+        local.http.post("/", data={"test": "1"}).raise_for_status()
+    assert calls[3:] == ["POST"]
+
+
+def test_errors_not_cached():
+    statuses = [500, 200]
+
+    def flaky(request):
+        return httpx.Response(statuses.pop(0), text='"item"')
+
+    local = Database(db_url="http://kv", transport=httpx.MockTransport(flaky))
+    with pytest.raises(httpx.HTTPStatusError):
+        local.get("test")
+    assert "test" not in local._cache
+    assert local.get("test") == "item"
+
+
+def test_hedging():
+    calls = []
+
+    def slow_once(request):
+        calls.append(request.url.path)
+        if len(calls) == 1:
+            sleep(0.5)
+        return httpx.Response(200, text='"item"')
+
+    policy = RetryPolicy(hedge=True, hedge_after=0.05)
+    local = Database(
+        db_url="http://kv", transport=httpx.MockTransport(slow_once), retry=policy
+    )
+    start = perf_counter()
+    assert local.get("test") == "item"
+    assert perf_counter() - start < 0.4
+    assert policy.hedges == 1 and len(calls) == 2
+
+
+def test_coherence():
+    with StandInServer() as server:
+        writer = Database(db_url=server.url, coherence=Coherence(interval=60))
+        reader = Database(db_url=server.url, coherence=Coherence(interval=60))
+        writer.set_bulk({"a": 1, "b": 2})
+        assert reader.sync_changes() == 0
+        assert reader.get("a") == 1 and reader.get("b") == 2
+        assert reader.sync_changes() == 0
+        writer.set("a", 3)
+        writer.delete("b")
+        assert reader.get("a") == 1
+        assert reader.sync_changes() == 2
+        assert reader.get("a") == 3 and reader.get("b") is None
+        assert reader.sync_changes() == 0
+        # each writer overwrites a single journal, which is never deleted one by one
+        for i in range(50):
+            writer.set(f"many:{i}", i)
+        journals = [k for k in server.store if k.startswith("__repltable_changes__:")]
+        assert len(journals) == 1
+        before = server.requests
+        writer.sync_changes()
+        assert server.requests - before == 1
+        # other processes' changes are applied to the key index, without a new listing
+        indexed = Database(
+            db_url=server.url, key_index=KeyIndex(), coherence=Coherence(interval=60)
+        )
+        indexed.sync_changes()
+        assert "many:0" in indexed.keys()
+        writer.set("fresh", 1)
+        writer.delete("many:0")
+        indexed.sync_changes()
+        before = server.requests
+        keys = indexed.keys()
+        assert "fresh" in keys and "many:0" not in keys
+        assert server.requests == before
+        indexed.close()
+        writer.close()
+        # journals that stop changing, like exited writers', are cleaned up by readers
+        janitor = Database(
+            db_url=server.url, coherence=Coherence(interval=60, retention=0)
+        )
+        janitor.sync_changes()
+        janitor.sync_changes()
+        assert not [k for k in server.store if k.startswith("__repltable_changes__:")]
+        janitor.close()
+        reader.close()
+
+
+def test_single_flight():
+    with StandInServer(latency=0.05) as server:
+        server.store["hot"] = '"value"'
+        local = Database(db_url=server.url)
+        with ThreadPoolExecutor(max_workers=10) as pool:
+            results = list(pool.map(lambda _: local.get("hot"), range(10)))
+            assert results == ["value"] * 10
+            assert server.requests == 1
+            tables = list(pool.map(lambda _: local.get_table("shared"), range(10)))
+        # one load: reading the table, and creating it along with its catalog entry
+        assert server.requests == 1 + 2
+        assert all(table is tables[0] for table in tables)
+        local.close()
+
+
+def test_prefetcher():
+    with StandInServer() as server:
+        for key in (
+            "user:1:profile",
+            "user:1:settings",
+            "user:1:prefs",
+            "user:2:profile",
+        ):
+            server.store[key] = '"value"'
+        prefetcher = Prefetcher(max_pending=2)
+        local = Database(db_url=server.url, prefetcher=prefetcher)
+        assert local.get("user:1:profile") == "value"
+        start = perf_counter()
+        while prefetcher.prefetched < 2 and perf_counter() - start < 2:
+            sleep(0.01)
+        requests = server.requests
+        assert local.get("user:1:settings") == local.get("user:1:prefs") == "value"
+        assert server.requests == requests == 4
+        assert prefetcher.pending == 0
+        local.close()
+    # a key written while it is being prefetched keeps the written value
+    with StandInServer(bandwidth=200_000) as server:
+        server.store["user:1:profile"] = '"value"'
+        server.store["user:1:settings"] = Codec().encode("old" * 30_000)
+        prefetcher = Prefetcher()
+        local = Database(db_url=server.url, prefetcher=prefetcher)
+        local.get("user:1:profile")
+        sleep(0.1)
+        local.set("user:1:settings", "new")
+        start = perf_counter()
+        while prefetcher.pending and perf_counter() - start < 5:
+            sleep(0.01)
+        assert prefetcher.prefetched == 1
+        assert local.get("user:1:settings") == "new"
+        local.close()
+    # a group refused for lack of budget can be read ahead as soon as there is some
+    budget = Prefetcher(max_pending=1)
+    assert budget.claim("user:1:profile") and not budget.claim("user:2:profile")
+    budget.release()
+    assert budget.claim("user:2:profile") and budget.skipped == 1
+
+
+def test_lazy_table():
+    rows = [{"id": i, "name": f"user {i}"} for i in range(20000)]
+    with StandInServer() as server:
+        local = Database(db_url=server.url)
+        server.store["lazy"] = Codec().encode(rows)
+        server.store["packed"] = Codec("zlib", compress_over=10).encode(rows)
+        server.store["invalid"] = "[1, 2]"
+        table = local.get_table("lazy", lazy=True)
+        assert isinstance(table.data, LazyRows)
+        assert next(iter(table.data)) == rows[0]
+        assert not table.data.complete
+        assert list(table.data) == rows and table.data.complete
+        assert list(local.iter_rows("packed")) == rows
+        assert local.get_table("packed").get(id=5) == [rows[5]]
+        with pytest.raises(ValueError):
+            list(local.iter_rows("invalid"))
+        local.close()
+
+
+def test_delete_many():
+    with StandInServer(latency=0.01) as server:
+        local = Database(db_url=server.url, key_index=KeyIndex())
+        local.set_bulk({f"tenant:{i}": i for i in range(200)})
+        local.set("kept", 1)
+        start = perf_counter()
+        assert local.delete_prefix("tenant:") == {}
+        # 200 deletes at 10ms each would take 2s one at a time
+        assert perf_counter() - start < 1
+        assert local.keys() == ["kept"] and list(server.store) == ["kept"]
+        assert local.get("tenant:1") is None
+        local.close()
+
+    def broken(request):
+        if request.url.path == "/bad":
+            return httpx.Response(500)
+        return httpx.Response(204)
+
+    local = Database(db_url="http://kv", transport=httpx.MockTransport(broken))
+    failed = local.delete_many(["good", "bad", "good"])
+    assert list(failed) == ["bad"] and isinstance(failed["bad"], httpx.HTTPStatusError)
@@ -1,4 +1,8 @@
 from repltable.asynchronous import Database, Table  # type: ignore
+from repltable import WriteBuffer, Prefetcher, Codec, RawCache, RetryPolicy  # type: ignore
+from repltable.testing import StandInServer  # type: ignore
+import asyncio
+import httpx
 from dotenv import load_dotenv
 from os import environ
 import pytest
@@ -12,31 +16,38 @@ if not environ.get("REPLIT_DB_URL"):
 @pytest.fixture(scope="function")
 def db():
     return Database(db_url=environ["REPLIT_DB_URL"])
+
+
 # db = Database(db_url=environ["REPLIT_DB_URL"])
 
+
 @pytest.mark.asyncio
 async def test_drop_all_iter():
     for i in await db.keys():
         await db.delete(i)
     assert await db.keys() == []
 
+
 @pytest.mark.asyncio
 async def test_get_table():
     table = await db.get_table("newtesttable")
     print(table)
     assert isinstance(table, Table)
 
+
 @pytest.mark.asyncio
 async def test_get_key():
     table = await db.get_table("newtesttable")
     print(await table.get(fdsfds=1))
     assert not await table.get(id=231231)
 
+
 @pytest.mark.asyncio
 async def test_drop_table():
     await db.delete("newtesttable")
     assert await db.get("newtesttable") is None
 
+
 @pytest.mark.asyncio
 async def test_db_set_get():
     await db.set("test", "item")
@@ -49,6 +60,7 @@ async def test_db_set_get():
     await db.delete("test")
     await db.delete("test2")
 
+
 @pytest.mark.asyncio
 async def test_set_get():
     table = await db.get_table("things")
@@ -76,6 +88,7 @@ async def test_set_get():
         and test_item["flob"] == "baz"
     )
 
+
 @pytest.mark.asyncio
 async def test_drop_table_with_data():
     table = await db.get_table("things")
@@ -84,6 +97,7 @@ async def test_drop_table_with_data():
     await db.delete("things")
     assert getattr(db, "things", None) is None
 
+
 @pytest.mark.asyncio
 async def test_delete():
     table = await db.get_table("things")
@@ -92,7 +106,226 @@ async def test_delete():
     await table.delete(id=2131)
     assert not await table.get(id=2131)
 
+
 @pytest.mark.asyncio
 async def drop_table_from_db():
     await db.delete("things")
     assert getattr(db, "things", None) is None
+
+
+@pytest.mark.asyncio
+async def test_populate_cache(db):
+    await db.set_bulk({"warm:a": "1", "warm:b": "2", "cold": "3"})
+    fresh = Database(db_url=environ["REPLIT_DB_URL"])
+    seen = []
+    await fresh.populate_cache(
+        prefix="warm:", concurrency=4, progress=lambda d, t: seen.append((d, t))
+    )
+    assert set(fresh._cache) == {"warm:a", "warm:b"}
+    assert seen[-1] == (2, 2)
+    for key in ("warm:a", "warm:b", "cold"):
+        await db.delete(key)
+
+
+@pytest.mark.asyncio
+async def test_get_many(db):
+    await db.set_bulk({"many:a": "one", "many:b": {"x": 1}})
+    fresh = Database(db_url=environ["REPLIT_DB_URL"])
+    await fresh.get("many:a")
+    assert await fresh.get_many(["many:a", "many:b", "many:missing"]) == {
+        "many:a": "one",
+        "many:b": {"x": 1},
+        "many:missing": None,
+    }
+    await db.delete("many:a")
+    await db.delete("many:b")
+
+
+@pytest.mark.asyncio
+async def test_write_behind():
+    buffered = Database(
+        db_url=environ["REPLIT_DB_URL"], write_behind=WriteBuffer(interval=0.05)
+    )
+    await buffered.set("test", "item")
+    await buffered.set("test", "item2")
+    assert await Database(db_url=environ["REPLIT_DB_URL"]).get("test") is None
+    await asyncio.sleep(0.2)
+    assert await Database(db_url=environ["REPLIT_DB_URL"]).get("test") == "item2"
+    await buffered.delete("test")
+    await buffered.close()
+    assert await Database(db_url=environ["REPLIT_DB_URL"]).get("test") is None
+
+    # a flushing delete stays visible until the database has applied it
+    store = {"k": '"old"'}
+
+    async def slow_deletes(request):
+        key = request.url.path[1:]
+        if request.method == "DELETE":
+            await asyncio.sleep(0.3)
+            store.pop(key, None)
+            return httpx.Response(200)
+        if key in store:
+            return httpx.Response(200, text=store[key])
+        return httpx.Response(404)
+
+    local = Database(
+        db_url="http://kv",
+        transport=httpx.MockTransport(slow_deletes),
+        write_behind=WriteBuffer(interval=60),
+    )
+    await local.delete("k")
+    flushing = asyncio.ensure_future(local.flush())
+    await asyncio.sleep(0.1)
+    assert await local.get("k") is None
+    await flushing
+    assert await local.get("k") is None and "k" not in local._cache
+    await local.close()
+
+
+@pytest.mark.asyncio
+async def test_batch(db):
+    table = await db.get_table("batched")
+    async with table.batch():
+        for i in range(10):
+            await table.insert(dict(id=i))
+    assert len(await Database(db_url=environ["REPLIT_DB_URL"]).get("batched")) == 10
+    with pytest.raises(RuntimeError):
+        async with table.batch():
+            await table.delete(id=0)
+            raise RuntimeError
+    assert table.data == [dict(id=i) for i in range(10)]
+    await db.delete("batched")
+
+
+@pytest.mark.asyncio
+async def test_iter_keys(db):
+    await db.set_bulk({"iter:a": "one", "iter:b": "two", "other": "three"})
+    assert [key async for key in db.iter_keys("iter:")] == ["iter:a", "iter:b"]
+    fresh = Database(db_url=environ["REPLIT_DB_URL"])
+    assert {
+        key: value async for key, value in fresh.iter_items("iter:", concurrency=1)
+    } == {
+        "iter:a": "one",
+        "iter:b": "two",
+    }
+    for key in ("iter:a", "iter:b", "other"):
+        await db.delete(key)
+
+
+@pytest.mark.asyncio
+async def test_single_flight():
+    with StandInServer(latency=0.05) as server:
+        server.store["hot"] = '"value"'
+        local = Database(db_url=server.url)
+        results = await asyncio.gather(*(local.get("hot") for _ in range(20)))
+        assert results == ["value"] * 20
+        assert server.requests == 1
+        await asyncio.gather(*(local.prefix("h") for _ in range(5)))
+        assert server.requests == 2
+        await local.close()
+
+
+@pytest.mark.asyncio
+async def test_prefetcher():
+    with StandInServer() as server:
+        for key in ("user:1:profile", "user:1:settings", "user:1:prefs"):
+            server.store[key] = '"value"'
+        prefetcher = Prefetcher()
+        local = Database(db_url=server.url, prefetcher=prefetcher)
+        assert await local.get("user:1:profile") == "value"
+        while prefetcher.pending:
+            await asyncio.sleep(0.01)
+        assert await local.get("user:1:settings") == "value"
+        assert server.requests == 4 and prefetcher.prefetched == 2
+        await local.close()
+    # a key written while it is being prefetched keeps the written value
+    with StandInServer(bandwidth=200_000) as server:
+        server.store["user:1:profile"] = '"value"'
+        server.store["user:1:settings"] = Codec().encode("old" * 30_000)
+        prefetcher = Prefetcher()
+        local = Database(db_url=server.url, prefetcher=prefetcher)
+        await local.get("user:1:profile")
+        await asyncio.sleep(0.1)
+        await local.set("user:1:settings", "new")
+        while prefetcher.pending:
+            await asyncio.sleep(0.01)
+        assert prefetcher.prefetched == 1
+        assert await local.get("user:1:settings") == "new"
+        await local.close()
+
+
+@pytest.mark.asyncio
+async def test_iter_rows():
+    rows = [{"id": i, "name": f"user {i}"} for i in range(20000)]
+    with StandInServer() as server:
+        server.store["streamed"] = Codec("zlib", compress_over=10).encode(rows)
+        local = Database(db_url=server.url)
+        assert [row async for row in local.iter_rows("streamed")] == rows
+        table = await local.get_table("streamed")
+        assert await table.get(id=5) == [rows[5]]
+        await local.close()
+
+
+@pytest.mark.asyncio
+async def test_delete_many():
+    with StandInServer(latency=0.01) as server:
+        local = Database(db_url=server.url)
+        await local.set_bulk({f"tenant:{i}": i for i in range(200)})
+        await local.set("kept", 1)
+        assert await local.delete_prefix("tenant:") == {}
+        assert await local.keys() == ["kept"]
+        assert await local.get("tenant:1") is None
+        await local.close()
+
+
+@pytest.mark.asyncio
+async def test_sorted_index():
+    with StandInServer() as server:
+        local = Database(db_url=server.url)
+        table = await local.get_table("sorted")
+        for created_at in (30, 10, 20):
+            await table.insert(dict(id=created_at // 10, created_at=created_at))
+        table.create_sorted_index("created_at")
+        await table.insert(dict(id=4, created_at=40))
+        assert [doc["id"] for doc in table.ordered("created_at", high=30)] == [1, 2, 3]
+        assert [doc["id"] for doc in await table.top_k("created_at", 2)] == [4, 3]
+        await table.delete(created_at__lte=10)
+        assert (await table.first("created_at"))["id"] == 2
+        assert (await table.last("created_at"))["id"] == 4
+        await local.close()
+
+
+@pytest.mark.asyncio
+async def test_raw_cache():
+    with StandInServer() as server:
+        for i in range(10):
+            server.store[f"raw:{i}"] = Codec().encode([{"id": i}])
+        cache = RawCache()
+        local = Database(db_url=server.url, cache=cache)
+        await local.populate_cache(prefix="raw:")
+        assert len(cache) == 10 and cache.decodes == 0
+        assert await local.get("raw:3") == [{"id": 3}]
+        assert cache.decodes == 1 and server.requests == 11
+        await local.close()
+
+
+@pytest.mark.asyncio
+async def test_hedging():
+    gate = asyncio.Event()
+    responses = []
+
+    class Gated(httpx.AsyncBaseTransport):
+        async def handle_async_request(self, request):
+            # both attempts finish together, once the gate opens
+            await gate.wait()
+            response = httpx.Response(200, stream=httpx.ByteStream(b'"item"'))
+            responses.append(response)
+            return response
+
+    policy = RetryPolicy(hedge=True, hedge_after=0.01)
+    local = Database(db_url="http://kv", transport=Gated(), retry=policy)
+    asyncio.get_running_loop().call_later(0.05, gate.set)
+    assert await local.get("test") == "item"
+    assert policy.hedges == 1 and len(responses) == 2
+    assert all(response.is_closed for response in responses)
+    await local.close()